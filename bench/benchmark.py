@@ -0,0 +1,519 @@
+# Benchmarks for building and querying the dictionary
+#
+# Usage: python bench/benchmark.py [options]
+#
+# Each operation is timed on the bundled lexicon.txt and on synthetic
+# lexicons made by repeating it (see scale_lexicon()), and the results are
+# printed and can be written as JSON with --output. With --baseline, the
+# results are compared with an earlier run, and the exit status is 1 if
+# any operation got more than --tolerance percent slower on average, e.g.:
+#
+#   python bench/benchmark.py --output results.json --baseline bench/baseline.json
+#
+# bench/baseline.json was made on one particular machine with
+# --save-baseline, so remake it before comparing runs on another one.
+#
+# For each operation this reports latency percentiles (in milliseconds),
+# throughput (calls per second, plus items such as entries or tokens per
+# second where that makes sense), and the peak memory allocated by Python
+# while running it (measured in a separate pass with tracemalloc, since
+# tracemalloc slows everything down; SQLite's own allocations aren't
+# included).
+#
+# The startup benchmarks time running the command line tool to look up a
+# word, which should take little longer than starting Python at all. The
+# exit status is also 1 if that takes more than STARTUP_BUDGET_MS longer, or
+# if any of LAZY_MODULES got imported along the way. tests/test_startup.py
+# checks the same things, so that the test suite catches them too.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from oedict import lexbin
+from oedict import lexdb
+from oedict import lexicon
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LEX_FILENAME = os.path.join(ROOT_DIR, 'lexicon.txt')
+
+DEFAULT_SCALES = [1, 10]
+
+# Number of words etc. to time each per-word operation with
+SAMPLE_SIZE = 2000
+
+# Number of calls of each per-word operation to measure memory over
+MEMORY_SAMPLE_SIZE = 200
+
+# Percentage by which an operation has to be slower than the baseline to
+# count as a regression
+DEFAULT_TOLERANCE = 50
+
+SEED = 1234
+
+# Words common enough in the definitions to match lots of entries
+COMMON_REVERSE_TERMS = ['to', 'the', 'of', 'a', 'one', 'make', 'king']
+
+# Weights of the parts of speech for weighted random lookups
+RANDOM_WEIGHTS = {'noun': 3, 'verb': 2, 'adjective': 1}
+
+# Number of times to run the command line tool for the startup benchmarks
+STARTUP_RUNS = 30
+
+# Most milliseconds that looking a word up with the command line tool may
+# take on top of starting Python (by median)
+STARTUP_BUDGET_MS = 60
+
+# How often (in seconds) the pool in the reload benchmark checks whether the
+# lexicon has changed, and the most seconds to wait for it to notice
+RELOAD_CHECK_INTERVAL = 0.05
+RELOAD_TIMEOUT = 600
+
+# Modules that looking a word up in an up-to-date database shouldn't import,
+# since they're slow to import and only needed for other things (mostly
+# building the database)
+LAZY_MODULES = [
+    'argparse', 'concurrent.futures', 'hashlib', 'json', 'markdown',
+    'random', 'tempfile', 'textwrap', 'unidecode', 'uuid',
+]
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    p = argparse.ArgumentParser(description="Benchmark the dictionary")
+    p.add_argument('-s', '--scale', type=int, nargs='+', default=DEFAULT_SCALES, help="lexicon sizes to test, as multiples of lexicon.txt")
+    p.add_argument('-o', '--output', help="write results to this JSON file")
+    p.add_argument('-b', '--baseline', help="compare results with this JSON file")
+    p.add_argument('--save-baseline', help="write results to this JSON file as a new baseline")
+    p.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="percentage slowdown from the baseline that counts as a regression")
+    p.add_argument('--no-memory', action='store_true', help="don't measure memory use (faster)")
+    p.add_argument('-k', '--only', help="only run operations whose names contain this")
+    args = p.parse_args(argv)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'scales': args.scale,
+        },
+        'results': {},
+    }
+    failed = False
+    with tempfile.TemporaryDirectory(prefix='oedict-bench-') as tmpdir:
+        for scale in args.scale:
+            bench = Benchmark(scale, tmpdir, not args.no_memory, args.only)
+            bench.run()
+            results['results'].update(bench.results)
+            failed = bench.failed or failed
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, 'w') as outfile:
+                json.dump(results, outfile, indent=1, sort_keys=True)
+                outfile.write("\n")
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        failed = compare(baseline, results, args.tolerance) or failed
+    if failed:
+        sys.exit(1)
+
+
+class Benchmark(object):
+    def __init__(self, scale, tmpdir, measure_memory=True, only=None):
+        self.scale = scale
+        self.dir = os.path.join(tmpdir, f'x{scale}')
+        self.measure_memory = measure_memory
+        self.only = only
+        self.results = {}
+        # Whether a budget was exceeded (see run_startup())
+        self.failed = False
+        self.rng = random.Random(SEED)
+        os.mkdir(self.dir)
+        self.lex_filename = os.path.join(self.dir, 'lexicon.txt')
+        self.db_filename = os.path.join(self.dir, 'lexicon.out.sqlite3')
+        with open(LEX_FILENAME, encoding='utf-8') as infile:
+            lines = infile.readlines()
+        with open(self.lex_filename, 'w', encoding='utf-8') as outfile:
+            outfile.writelines(scale_lexicon(lines, scale))
+
+    def run(self):
+        print(f"== {self.scale}x lexicon ==")
+        lex = lexicon.Lexicon(self.lex_filename, gen_index=False)
+        entries = lex.entries
+        num_entries = len(entries)
+        # Repeat the quick bulk operations so the percentiles mean something
+        repeat = max(1, 5 // self.scale)
+
+        self.time('parse', lambda _: lexicon.Lexicon(self.lex_filename, gen_index=False), [None] * repeat, num_entries)
+        self.time('index', lambda _: lexicon.Lexicon(self.lex_filename), [None] * repeat, num_entries)
+
+        pairs = [(entry, word_type) for entry in entries for word_type in entry.word_types]
+        self.time(
+            'gen_forms',
+            lambda pair: lexicon.gen_forms(pair[0].lemma, pair[1], pair[0].special),
+            self.sample(pairs)
+        )
+        forms = sorted(set(form for entry in entries for form in lexicon.entry_forms(entry)))
+        self.time('gen_variants', lexicon.gen_variants, self.sample(forms))
+
+        build_dir = os.path.join(self.dir, 'build')
+        os.mkdir(build_dir)
+        build_filename = os.path.join(build_dir, 'lexicon.out.sqlite3')
+        self.time(
+            'gen_db',
+            lambda _: lexdb.LexDB.gen_db(self.lex_filename, build_filename),
+            [None] * repeat,
+            num_entries
+        )
+        # (If gen_db was skipped, LexDB builds the database itself below)
+        if os.path.exists(build_filename):
+            shutil.move(build_filename, self.db_filename)
+
+        with lexdb.LexDB(self.lex_filename, self.db_filename) as db:
+            self.run_queries(db, entries, forms)
+
+        self.run_web(entries, forms)
+        self.run_reload()
+        self.run_startup(forms)
+
+    def run_queries(self, db, entries, forms):
+        hits = self.sample(forms)
+        misses = self.misses(db)
+        redirects = self.sample([entry.lemma for entry in entries if lexdb.REDIRECT_RE.match(entry.text)])
+        self.time('lookup.hit', db.lookup, hits)
+        self.time('lookup.miss', db.lookup, misses)
+        self.time('lookup.redirect', db.lookup, redirects)
+        self.time('lookup_many', db.lookup_many, [hits[i:i+100] for i in range(0, len(hits), 100)], 100)
+        self.time('suggest', db.suggest, misses[:SAMPLE_SIZE // 4])
+        self.time('complete', db.complete, [form[:3] for form in hits])
+        self.time('browse', db.browse, [form[:3] for form in hits])
+        self.time('lookup_forms', db.lookup_forms, hits)
+        self.time('paradigms', db.paradigms, hits)
+        self.time('reverse_lookup.common', db.reverse_lookup, COMMON_REVERSE_TERMS * 10)
+        self.time('reverse_lookup.rare', db.reverse_lookup, self.rare_terms(entries))
+        # How long it takes for the first result of a streamed search
+        self.time('reverse_lookup.first', lambda term: next(db.iter_reverse_lookup(term), None), COMMON_REVERSE_TERMS * 10)
+        self.time('random_lookup', lambda _: db.random_lookup(), [None] * (SAMPLE_SIZE // 4))
+        self.time('random_lookup.seeded', db.random_lookup, range(SAMPLE_SIZE // 4))
+        self.time('random_lookup.weighted', lambda _: db.random_lookup(weights=RANDOM_WEIGHTS), [None] * (SAMPLE_SIZE // 4))
+        text = " ".join(self.rng.choice(hits) for _ in range(10000))
+        self.time('lemmatize', lambda text: sum(1 for _ in db.lemmatize(text)), [text] * 3, 10000)
+
+        # The same lookups in a compiled lexicon (see lexbin)
+        bin_filename = lexbin.compiled_filename(self.db_filename)
+        self.time('compile', lambda _: lexbin.compile_lexicon(db, bin_filename).close(), [None] * 3)
+        with lexdb.LexDB(self.lex_filename, self.db_filename, check_outdated=False, compiled=True) as compiled_db:
+            self.time('compiled.lookup.hit', compiled_db.lookup, hits)
+            self.time('compiled.lookup.miss', compiled_db.lookup, misses)
+            self.time('compiled.lookup.redirect', compiled_db.lookup, redirects)
+            self.time('compiled.lemmatize', lambda text: sum(1 for _ in compiled_db.lemmatize(text)), [text] * 3, 10000)
+
+    def run_web(self, entries, forms):
+        # The web app opens lexicon.txt in the current directory when it's
+        # imported, so make that ours
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            from oedict import wsgi
+        except ImportError:
+            print("Skipping web benchmarks (flask isn't installed)")
+            return
+        finally:
+            os.chdir(cwd)
+        pool = lexdb.LexDBPool(self.lex_filename, self.db_filename)
+        old_pool = wsgi.pool
+        wsgi.pool = pool
+        try:
+            client = wsgi.application.test_client()
+            hits = self.sample(forms, SAMPLE_SIZE // 4)
+            with lexdb.LexDB(self.lex_filename, self.db_filename) as db:
+                misses = self.misses(db, SAMPLE_SIZE // 4)
+            get = lambda url: check_status(client.get(url), 200)
+            self.time('web.search_oe.hit', get, [f'/api/search/oe/{word}' for word in hits])
+            self.time('web.search_oe.miss', get, [f'/api/search/oe/{word}' for word in misses])
+            self.time('web.search_reverse', get, [f'/api/search/reverse/{term}' for term in COMMON_REVERSE_TERMS * 10])
+            self.time('web.random', get, ['/api/search/random/'] * (SAMPLE_SIZE // 4))
+            self.time('web.complete', get, [f'/api/complete/{word[:3]}' for word in hits])
+            etag = client.get(f'/api/search/oe/{hits[0]}').headers['ETag']
+            self.time(
+                'web.not_modified',
+                lambda url: check_status(client.get(url, headers={'If-None-Match': etag}), 304),
+                [f'/api/search/oe/{hits[0]}'] * (SAMPLE_SIZE // 4)
+            )
+        finally:
+            wsgi.pool = old_pool
+            pool.close()
+
+    # Times how long a LexDBPool takes to switch over to a database
+    # regenerated from an edited lexicon. Also checks that it still does
+    # after an edit that leaves a mistake in the lexicon has been fixed.
+    def run_reload(self):
+        if self.only and self.only not in f'{self.scale}x/reload':
+            return
+        reload_dir = os.path.join(self.dir, 'reload')
+        os.mkdir(reload_dir)
+        lex_filename = os.path.join(reload_dir, 'lexicon.txt')
+        db_filename = os.path.join(reload_dir, 'lexicon.out.sqlite3')
+        shutil.copy(self.lex_filename, lex_filename)
+        shutil.copy(self.db_filename, db_filename)
+        with open(lex_filename, encoding='utf-8') as infile:
+            text = infile.read()
+
+        def write(extra):
+            with open(lex_filename, 'w', encoding='utf-8') as outfile:
+                outfile.write(text + extra)
+
+        # The pool logs the mistake, which is expected here
+        logger = logging.getLogger('oedict.lexdb')
+        logger.disabled = True
+        try:
+            with lexdb.LexDBPool(lex_filename, db_filename, RELOAD_CHECK_INTERVAL, settle_time=0) as pool:
+                def edit(num):
+                    build = pool.build_info()
+                    write(f"reloadtest{num}, nm:\n    test\n")
+                    if not wait_for(lambda: pool.build_info() != build):
+                        raise RuntimeError("The database wasn't reloaded after the lexicon was edited")
+
+                self.time('reload', edit, range(max(1, 5 // self.scale)), measure_memory=False)
+                build = pool.build_info()
+                write("reloadtest, nm\n")
+                noticed = wait_for(lambda: pool.failed_mtime is not None or not pool.watcher.is_alive())
+                if not noticed or pool.build_info() != build or not pool.watcher.is_alive():
+                    print("A mistake in the lexicon wasn't handled")
+                    self.failed = True
+                    return
+                write("reloadtest, nm:\n    test\n")
+                if not wait_for(lambda: pool.build_info() != build):
+                    print("The database wasn't reloaded after a mistake in the lexicon was fixed")
+                    self.failed = True
+        finally:
+            logger.disabled = False
+
+    def run_startup(self, forms):
+        # Run from the benchmark's directory, where the tool finds the
+        # lexicon and the (up-to-date) database by default
+        env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+        run = lambda command: subprocess.run(
+            [sys.executable] + command,
+            cwd=self.dir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True
+        )
+        word = self.rng.choice([form for form in forms if form.isascii()])
+        bare = self.time('startup.bare', run, [['-c', 'pass']] * STARTUP_RUNS, measure_memory=False)
+        lookup = self.time('startup.lookup', run, [['-m', 'oedict', word]] * STARTUP_RUNS, measure_memory=False)
+        if bare and lookup:
+            overhead = lookup['p50_ms'] - bare['p50_ms']
+            print(f"Startup overhead {overhead:.1f}ms (budget {STARTUP_BUDGET_MS}ms)")
+            if overhead > STARTUP_BUDGET_MS:
+                print("Startup is over budget")
+                self.failed = True
+        if not self.only or self.only in f'{self.scale}x/startup.modules':
+            script = (
+                "import sys\n"
+                "from oedict import cli\n"
+                f"cli.main([{word!r}])\n"
+                f"print(sorted(set({LAZY_MODULES!r}) & set(sys.modules)), file=sys.stderr)\n"
+            )
+            output = subprocess.run(
+                [sys.executable, '-c', script],
+                cwd=self.dir,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                check=True
+            )
+            imported = output.stderr.strip()
+            if imported != "[]":
+                print(f"Looking up a word imported {imported}")
+                self.failed = True
+
+    # Times func on each of args. items is the number of items (such as
+    # entries) that each call processes, for reporting throughput. Returns
+    # the result, or None if the operation was skipped.
+    def time(self, name, func, args, items=1, measure_memory=True):
+        name = f'{self.scale}x/{name}'
+        if self.only and self.only not in name:
+            return None
+        # Warm up caches and so on
+        for arg in args[:min(len(args) // 10, 100)]:
+            func(arg)
+        times = []
+        start = time.perf_counter()
+        for arg in args:
+            t = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - t)
+        total = time.perf_counter() - start
+        times.sort()
+        result = {
+            'calls': len(times),
+            'p50_ms': percentile(times, 50) * 1000,
+            'p90_ms': percentile(times, 90) * 1000,
+            'p99_ms': percentile(times, 99) * 1000,
+            'max_ms': times[-1] * 1000,
+            'mean_ms': total / len(times) * 1000,
+            'calls_per_s': len(times) / total,
+        }
+        if items != 1:
+            result['items_per_s'] = len(times) * items / total
+        if self.measure_memory and measure_memory:
+            # One call is enough for the slow operations such as gen_db
+            count = MEMORY_SAMPLE_SIZE if total < 1 else 1
+            tracemalloc.start()
+            for arg in args[:count]:
+                func(arg)
+            result['peak_memory_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        self.results[name] = result
+        print(format_result(name, result))
+        return result
+
+    def sample(self, items, size=SAMPLE_SIZE):
+        if len(items) <= size:
+            return list(items)
+        return self.rng.sample(items, size)
+
+    # Returns made-up words that aren't in the dictionary
+    def misses(self, db, size=SAMPLE_SIZE):
+        letters = "abcdefghilmnoprstuwyæþāēīōū"
+        results = []
+        while len(results) < size:
+            word = "".join(self.rng.choice(letters) for _ in range(self.rng.randint(4, 9)))
+            if not db.find_ids(lexicon.normalize(word)):
+                results.append(word)
+        return results
+
+    # Returns words that appear in as few definitions as possible (only one
+    # unless the lexicon has been scaled up)
+    def rare_terms(self, entries):
+        counts = {}
+        for entry in entries:
+            if not lexdb.REDIRECT_RE.match(entry.text):
+                for word in set(re.findall(r"[a-z]{4,}", entry.text.lower())):
+                    counts[word] = counts.get(word, 0) + 1
+        rarest = min(counts.values())
+        return self.sample(sorted(word for word, count in counts.items() if count == rarest), SAMPLE_SIZE // 4)
+
+
+# Returns the lines of a lexicon file containing num_copies copies of the
+# entries in lines. Each copy after the first has a different prefix added
+# to its lemma, to the forms in its specials, and to the targets of its
+# redirects, so each copy's words are distinct but have the same forms (and
+# the same index words) as the original.
+def scale_lexicon(lines, num_copies):
+    results = list(lines)
+    for copy in range(1, num_copies):
+        prefix = copy_prefix(copy)
+        for line in lines:
+            if line.startswith(" "):
+                results.append(re.sub(r"^(\s+SEE\s+)", r"\1" + prefix, line))
+            elif line.strip() and not line.startswith("#"):
+                results.append(prefix_header(line, prefix))
+            else:
+                results.append(line)
+    return results
+
+# Returns a made-up prefix (e.g. "baz-") for a copy of the lexicon
+def copy_prefix(copy):
+    consonants = "bdfglmnprst"
+    syllables = []
+    while True:
+        copy, digit = divmod(copy, len(consonants) * 5)
+        syllables.append(consonants[digit // 5] + "aeiou"[digit % 5])
+        if copy == 0:
+            break
+    return "".join(syllables) + "z-"
+
+def prefix_header(line, prefix):
+    lemma_section, special_section = line.strip().split(":", 1)
+    specials = []
+    for item in special_section.split(";"):
+        if item.strip():
+            form, args = item.split(maxsplit=1)
+            args = "|".join(arg if arg == "-" else prefix + arg for arg in args.split("|"))
+            specials.append(f"{form} {args}")
+    special_text = " " + "; ".join(specials) if specials else ""
+    return f"{prefix}{lemma_section.strip()}:{special_text}\n"
+
+
+# Also reads the whole body, since streamed responses are only generated as
+# they're read
+def check_status(response, status):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.path}: expected {status}, got {response.status_code}")
+    response.get_data()
+
+
+# Waits until condition() is true, for at most RELOAD_TIMEOUT seconds.
+# Returns whether it came true.
+def wait_for(condition):
+    deadline = time.monotonic() + RELOAD_TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(RELOAD_CHECK_INTERVAL / 5)
+    return True
+
+
+# times must be sorted
+def percentile(times, percent):
+    index = min(len(times) - 1, int(len(times) * percent / 100))
+    return times[index]
+
+
+def format_result(name, result):
+    text = (f"{name:32} p50 {result['p50_ms']:9.3f}ms  p90 {result['p90_ms']:9.3f}ms"
+            f"  p99 {result['p99_ms']:9.3f}ms  {result['calls_per_s']:10.1f}/s")
+    if 'items_per_s' in result:
+        text += f" ({result['items_per_s']:.0f} items/s)"
+    if 'peak_memory_kib' in result:
+        text += f"  peak {result['peak_memory_kib']:.0f}KiB"
+    return text
+
+
+# Prints how each result compares with the baseline. Returns True if any
+# operation's mean latency got more than tolerance percent worse.
+# The mean is used rather than the median since some operations are timed
+# on a mix of inputs that take very different amounts of time (such as
+# COMMON_REVERSE_TERMS), which makes the median jump from one to another.
+def compare(baseline, results, tolerance):
+    print(f"== Compared with baseline from {baseline['meta']['time']} ==")
+    regressed = False
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['mean_ms']
+        new = result['mean_ms']
+        change = (new - old) / old * 100 if old else 0
+        if change > tolerance:
+            status = "REGRESSED"
+            regressed = True
+        elif change < -tolerance:
+            status = "improved"
+        else:
+            status = ""
+        print(f"{name:32} {old:9.3f}ms -> {new:9.3f}ms  {change:+7.1f}%  {status}")
+    return regressed
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
 from oedict.cli import main
-main()
+
+# Worker processes started with the spawn method (see
+# lexicon.index_entries()) import this module too
+if __name__ == '__main__':
+    main()
 
@@ -0,0 +1,448 @@
+# An ASGI version of the web API in wsgi.py, with the same routes (both are
+# built on web.py, which does all the work), for serving with any ASGI
+# server, e.g.:
+#   uvicorn oedict.asgi:application
+# The event loop only juggles connections. The lookups themselves run on a
+# thread pool of WORKERS threads, each with its own pooled read-only
+# connection, so a slow reverse search only holds up its own client. If a
+# client disconnects before its response is ready, the query it was waiting
+# for is interrupted.
+# This is only as much of a framework as the API needs: errors are plain
+# text, and a path without the trailing slash of its route just matches it.
+# It can be tested without a server by calling application in the same
+# process, as tests/test_asgi.py does with the client in
+# tests/asgi_client.py (or with any ASGI transport, e.g. httpx's
+# ASGITransport).
+
+import asyncio
+import atexit
+import concurrent.futures
+import datetime
+import email.utils
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+from . import lexdb
+from . import web
+
+
+# Number of threads running lookups; requests beyond this many wait their
+# turn
+WORKERS = int(os.environ.get('OEDICT_WORKERS', 4))
+
+HTML = 'text/html; charset=utf-8'
+JSON = 'application/json'
+
+log = logging.getLogger(__name__)
+
+pool = web.make_pool()
+executor = concurrent.futures.ThreadPoolExecutor(WORKERS, thread_name_prefix='oedict')
+
+metrics = web.Metrics()
+
+# (rule, regex, methods, handler) for each route (see route())
+routes = []
+
+
+def close():
+    executor.shutdown(wait=False, cancel_futures=True)
+    pool.close()
+
+
+atexit.register(close)
+
+
+# Raised when the client has gone away, so there's no one to respond to
+class Disconnected(Exception):
+    pass
+
+
+class Request(object):
+    def __init__(self, scope, body, receive):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b"").decode('latin-1')
+        self.args = urllib.parse.parse_qsl(self.query_string, keep_blank_values=True, errors='replace')
+        # Header names are lowercase, and repeated headers are joined
+        self.headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = f"{self.headers[name]}, {value}" if name in self.headers else value
+        self.body = body
+        self.stats = lexdb.Stats() if web.INSTRUMENT else None
+        # Finishes when the client disconnects
+        self.disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    # Like flask.request.args.get()
+    def arg(self, key, default=None, type=str):
+        for name, value in self.args:
+            if name == key:
+                try:
+                    return type(value)
+                except ValueError:
+                    return default
+        return default
+
+
+# body is a str, or an async iterator of str for a streamed response
+class Response(object):
+    def __init__(self, body="", status=200, content_type=HTML, headers=()):
+        self.body = body
+        self.status = status
+        self.headers = list(headers)
+        if content_type is not None:
+            self.headers.insert(0, ('content-type', content_type))
+
+    async def send(self, send, head=False):
+        headers = self.headers
+        if isinstance(self.body, str):
+            body = self.body.encode()
+            headers = headers + [('content-length', str(len(body)))]
+            await send({'type': 'http.response.start', 'status': self.status, 'headers': encode_headers(headers)})
+            await send({'type': 'http.response.body', 'body': b"" if head else body})
+            return
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': encode_headers(headers)})
+        try:
+            if not head:
+                async for chunk in self.body:
+                    await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        finally:
+            await self.body.aclose()
+        await send({'type': 'http.response.body', 'body': b""})
+
+
+def encode_headers(headers):
+    return [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+# Decorator that adds a route. rule is in the same form as Flask's, and
+# handlers are called with the request and the variable parts of the path as
+# keyword arguments. A trailing slash at the end of a rule is optional.
+def route(rule, methods=('GET',)):
+    regex = re.compile("".join(
+        f"(?P<{part[1:-1]}>[^/]+)" if part.startswith("<") else re.escape(part)
+        for part in re.split(r"(<\w+>)", rule.rstrip("/"))
+    ) + ("/?" if rule.endswith("/") else ""))
+
+    def decorator(handler):
+        routes.append((rule, regex, methods, handler))
+        return handler
+    return decorator
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    start_time = time.perf_counter()
+    try:
+        body = await read_body(receive)
+    except Disconnected:
+        return
+    request = Request(scope, body, receive)
+    try:
+        rule, handler, params = match(request)
+        try:
+            response = await handler(request, **params)
+        except Disconnected:
+            return
+        except Exception:
+            log.exception("Error handling %s %s", request.method, request.path)
+            response = error(500, "Internal Server Error")
+        # A streamed body is only generated as it's sent, so the Server-Timing
+        # header only covers what was done first, and the request is
+        # recorded once it's been sent
+        if request.stats is not None:
+            seconds = time.perf_counter() - start_time
+            response.headers.append(('server-timing', web.server_timing(request.stats, seconds)))
+        try:
+            await response.send(send, head=request.method == 'HEAD')
+        except Disconnected:
+            return
+        if request.stats is not None:
+            seconds = time.perf_counter() - start_time
+            label = rule or "<unmatched>"
+            metrics.observe(label, seconds, request.stats)
+            web.log_if_slow(
+                request.method,
+                request.path,
+                request.query_string,
+                label,
+                response.status,
+                seconds,
+                request.stats
+            )
+    finally:
+        request.disconnected.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise Disconnected
+        chunks.append(message.get('body', b""))
+        if not message.get('more_body'):
+            return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+# Returns (rule, handler, params) for the route matching the request
+def match(request):
+    method = 'GET' if request.method == 'HEAD' else request.method
+    allowed = []
+    for rule, regex, methods, handler in routes:
+        matches = regex.fullmatch(request.path)
+        if matches:
+            if method in methods:
+                return rule, handler, matches.groupdict()
+            allowed += methods
+    if allowed:
+        return None, method_not_allowed, {'allowed': allowed}
+    return None, not_found, {}
+
+
+def error(status, text, headers=()):
+    return Response(f"{status} {text}\n", status, 'text/plain; charset=utf-8', headers)
+
+
+async def not_found(request):
+    return error(404, "Not Found")
+
+
+def bad_request():
+    return error(400, "Bad Request")
+
+
+async def method_not_allowed(request, allowed):
+    return error(405, "Method Not Allowed", [('allow', ", ".join(allowed))])
+
+
+# Runs func(db, *args) on the thread pool with a pooled connection. If the
+# client disconnects first, the query the thread is running is interrupted
+# and this raises Disconnected.
+async def run(request, func, *args):
+    loop = asyncio.get_running_loop()
+    lock = threading.Lock()
+    running = []
+
+    def work():
+        with web.connection(pool, request.stats) as db:
+            with lock:
+                running.append(db)
+            try:
+                return func(db, *args)
+            finally:
+                with lock:
+                    running.remove(db)
+
+    future = loop.run_in_executor(executor, work)
+    await asyncio.wait([future, request.disconnected], return_when=asyncio.FIRST_COMPLETED)
+    if not future.done():
+        # Any connection still in running is in the middle of func, so this
+        # can't interrupt another request's query
+        with lock:
+            for db in running:
+                db.conn.interrupt()
+        future.cancel()
+        raise Disconnected
+    return future.result()
+
+
+# Streams what func(db, *args) yields, joined into chunks the way
+# LexDB.iter_query() batches rows: the first chunk is lexdb.FIRST_BATCH_SIZE
+# items, so that the response starts quickly, and each chunk after that is
+# twice the size of the last, up to lexdb.BATCH_SIZE. Each chunk is made by
+# a task of its own on the thread pool, so a client that reads slowly
+# doesn't keep a thread from other requests between chunks. The tasks can
+# run on different threads, so the stream has a connection of its own (see
+# LexDBPool.connect()). If the client disconnects, the query is interrupted.
+async def stream(request, func, *args):
+    db = None
+    items = None
+    task = None
+
+    def next_chunk(size):
+        nonlocal db, items
+        if db is None:
+            with web.phase(request.stats, 'connect'):
+                db = pool.connect()
+            db.stats = request.stats
+            items = func(db, *args)
+        chunk = list(itertools.islice(items, size))
+        return "".join(chunk), len(chunk) < size
+
+    def close():
+        if items is not None:
+            items.close()
+        if db is not None:
+            db.close()
+
+    size = lexdb.FIRST_BATCH_SIZE
+    try:
+        while True:
+            task = executor.submit(next_chunk, size)
+            future = asyncio.wrap_future(task)
+            await asyncio.wait([future, request.disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if not future.done():
+                future.cancel()
+                raise Disconnected
+            chunk, finished = future.result()
+            if chunk:
+                yield chunk
+            if finished:
+                break
+            size = min(size * 2, lexdb.BATCH_SIZE)
+    finally:
+        if task is not None and not task.cancel() and not task.done():
+            # It's in the middle of a chunk, so stop its query, and close
+            # once it's stopped
+            if db is not None:
+                db.conn.interrupt()
+            task.add_done_callback(lambda task: close())
+        else:
+            close()
+
+
+# Runs a view whose response only depends on the request and the database,
+# like wsgi.cached(): responses get an ETag and Last-Modified, and a client
+# that already has the current response gets a 304 without the view being
+# called
+# The 304 is decided on the event loop (pool.build_info() doesn't touch the
+# database), so it doesn't wait for a thread behind slow searches.
+# func can return the text of the response, or a Response to add the
+# caching headers to.
+async def cached(request, func, *args, content_type=HTML):
+    build_id, build_time = pool.build_info()
+    etag = web.etag(build_id, request.path, request.args)
+    headers = [
+        ('etag', f'"{etag}"'),
+        ('last-modified', email.utils.formatdate(build_time, usegmt=True)),
+        ('cache-control', f"public, max-age={web.CACHE_MAX_AGE}, s-maxage={web.SHARED_CACHE_MAX_AGE}"),
+    ]
+    if not_modified(request, etag, build_time):
+        return Response("", 304, None, headers)
+    result = await run(request, func, *args)
+    if isinstance(result, Response):
+        result.headers += headers
+        return result
+    return Response(result, content_type=content_type, headers=headers)
+
+
+def not_modified(request, etag, build_time):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        return any(
+            tag.strip() == "*" or tag.strip().removeprefix("W/").strip('"') == etag
+            for tag in if_none_match.split(",")
+        )
+    try:
+        since = email.utils.parsedate_to_datetime(request.headers['if-modified-since'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    return since.timestamp() >= build_time
+
+
+if web.INSTRUMENT:
+    @route('/metrics')
+    async def metrics_view(request):
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@route('/api/search/oe/')
+@route('/api/search/oe/<search_terms>')
+async def search_oe(request, search_terms=web.DEFAULT_SEARCH_TERMS):
+    return await cached(request, web.search_oe, search_terms)
+
+
+@route('/api/search/reverse/')
+@route('/api/search/reverse/<search_string>')
+async def search_reverse(request, search_string=web.DEFAULT_SEARCH_STRING):
+    limit = request.arg('limit', type=int)
+    offset = request.arg('offset', 0, type=int)
+    cursor = request.arg('cursor')
+    if not web.valid_reverse_cursor(cursor):
+        return bad_request()
+
+    def view(db):
+        body = stream(request, web.search_reverse, request.path, search_string, limit, offset, cursor)
+        return Response(body, headers=[('x-total-count', web.count_reverse(db, search_string))])
+    return await cached(request, view)
+
+
+@route('/api/suggest/<word>')
+async def suggest(request, word):
+    limit = request.arg('limit', lexdb.SUGGESTION_LIMIT, type=int)
+    return await cached(request, web.suggest, word, limit, content_type=JSON)
+
+
+@route('/api/complete/<prefix>')
+async def complete(request, prefix):
+    limit = request.arg('limit', lexdb.COMPLETION_LIMIT, type=int)
+    return await cached(request, web.complete, prefix, limit, content_type=JSON)
+
+
+@route('/api/paradigm/<word>')
+async def paradigms(request, word):
+    return await cached(request, web.paradigms, word, content_type=JSON)
+
+
+@route('/api/browse/')
+@route('/api/browse/<start>')
+async def browse(request, start=""):
+    cursor = request.arg('cursor')
+    limit = request.arg('limit', lexdb.BROWSE_LIMIT, type=int)
+    if not web.valid_cursor(cursor):
+        return bad_request()
+
+    def view(db):
+        text, link = web.browse(db, request.path, start, cursor, limit)
+        return Response(text, headers=[('link', link)] if link is not None else [])
+    return await cached(request, view)
+
+
+@route('/api/lemmatize', methods=('POST',))
+async def lemmatize(request):
+    text = request.body.decode('utf-8', 'replace')
+    return Response(stream(request, web.lemmatize, text), content_type='application/x-ndjson')
+
+
+@route('/api/search/random/')
+async def random(request):
+    types = [value for name, value in request.args if name == 'type']
+    text = await run(request, web.random_entry, request.arg('seed'), types)
+    return Response(text, headers=[('cache-control', 'no-store')])
+
+
+@route('/api/search/daily/')
+async def daily(request):
+    date, max_age = web.daily_date(request.arg('date'))
+    types = [value for name, value in request.args if name == 'type']
+    text = await run(request, web.daily_entry, date, types)
+    return Response(text, headers=[('cache-control', f"public, max-age={max_age}")])
@@ -1,51 +1,253 @@
-import argparse
+import io
 import sys
-import textwrap
+import types
 
 from . import lexdb
 from . import lexicon
 
 
+# The value of each option when it isn't given
+DEFAULTS = {
+    'lexicon': 'lexicon.txt',
+    'interactive': False,
+    'reverse': False,
+    'complete': False,
+    'browse': False,
+    'paradigm': False,
+    'cursor': None,
+    'db': 'lexicon.out.sqlite3',
+    'lemmatize': False,
+    'abc': False,
+    'incremental': False,
+    'jobs': 1,
+    'index_mode': None,
+    'in_memory': False,
+    'compiled': False,
+    'limit': None,
+    'offset': 0,
+    'dump_forms': False,
+}
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
+    # Plain lookups ("oedict word ...") are often run many times over from
+    # scripts, where startup time is most of the time taken, so they don't
+    # wait for argparse to be imported
+    if argv and not any(arg.startswith("-") for arg in argv):
+        args = types.SimpleNamespace(search_terms=argv, **DEFAULTS)
+    else:
+        args = parse_args(argv)
+    if args.lexicon == '-':
+        # Always regenerates the database
+        args.lexicon = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    try:
+        run(args)
+    except lexicon.LexiconError as err:
+        print("Line", err.line_num, ":", err, file=sys.stderr)
+        sys.exit(1)
+
+
+def run(args):
+    if args.dump_forms:
+        dump_forms(lexicon.Lexicon(args.lexicon, gen_index=False))
+        return
+    with lexdb.LexDB(
+        args.lexicon,
+        args.db,
+        incremental=args.incremental,
+        jobs=args.jobs,
+        index_mode=args.index_mode,
+        in_memory=args.in_memory,
+        compiled=args.compiled
+    ) as db:
+        if args.abc:
+            db.check_alphabetization()
+        if args.lemmatize:
+            lemmatize(db, io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8'))
+        search_terms = args.search_terms
+        if args.browse and not search_terms:
+            # Browse from the beginning (or the cursor)
+            search_terms = [""]
+        for term in search_terms:
+            lookup(db, term, args)
+        if args.interactive:
+            interactive_mode(db, args)
+
+
+def parse_args(argv):
+    import argparse
     p = argparse.ArgumentParser(description="Kef's Old English dictionary")
-    p.add_argument('-l', '--lexicon', default='lexicon.txt', help="filename of lexicon")
+    p.set_defaults(**DEFAULTS)
+    p.add_argument('-l', '--lexicon', help="filename of lexicon (- to read from stdin)")
     p.add_argument('-i', '--interactive', action='store_true', help="interactive mode")
     p.add_argument('-r', '--reverse', action='store_true', help="reverse lookup")
-    p.add_argument('-d', '--db', default='lexicon.out.sqlite3', help="filename of sqlite database")
+    p.add_argument('-c', '--complete', action='store_true', help="list forms beginning with each search term")
+    p.add_argument('-b', '--browse', action='store_true', help="list entries in alphabetical order from each search term (or the beginning)")
+    p.add_argument('-p', '--paradigm', action='store_true', help="print the inflection tables of the entries with each search term as a form")
+    p.add_argument('--cursor', help="where to carry on browsing or a reverse lookup from (as printed at the end of the previous page)")
+    p.add_argument('-d', '--db', help="filename of sqlite database")
+    p.add_argument('--lemmatize', action='store_true', help="look up every word of the text read from stdin")
     p.add_argument('--abc', action='store_true', help="check lexicon is in alphabetical order")
+    p.add_argument('--incremental', action='store_true', help="only regenerate changed entries when updating database")
+    p.add_argument('-j', '--jobs', type=int, help="number of processes to use when generating database (0 = one per CPU)")
+    p.add_argument('--index-mode', choices=lexicon.INDEX_MODES, help="how to index spelling variants when generating database")
+    p.add_argument('--in-memory', action='store_true', help="copy the whole database into memory when opening it")
+    p.add_argument('--compiled', action='store_true', help="look words up in a compiled lexicon file (made from the database if need be) rather than the database")
+    p.add_argument('--limit', type=int, help="maximum number of reverse lookup results, completions or entries when browsing")
+    p.add_argument('--offset', type=int, help="number of reverse lookup results to skip")
+    p.add_argument('--dump-forms', action='store_true', help="print the generated forms of every entry and exit (for checking that changes to the paradigms don't change their output)")
     p.add_argument('search_terms', nargs='*')
     args = p.parse_args(argv)
-    with lexdb.LexDB(args.lexicon, args.db) as db:
-        if args.abc:
-            db.check_alphabetization()
-        for term in args.search_terms:
-            lookup(db, term, args.reverse)
-        if args.interactive:
-            interactive_mode(db, args.reverse)
+    if args.lemmatize and args.lexicon == '-':
+        p.error("can't read both the lexicon and the text to lemmatize from stdin")
+    if args.jobs is not None and args.jobs < 0:
+        p.error("the number of jobs can't be negative")
+    return args
+
 
+# Prints one line per form name of each word type of each entry:
+#   lemma<TAB>word type<TAB>form name<TAB>form|form|...
+def dump_forms(lex):
+    for entry in lex.entries:
+        for word_type in entry.word_types:
+            forms = lexicon.gen_forms(entry.lemma, word_type, entry.special)
+            for name, value in forms.items():
+                print(entry.lemma, word_type, name, "|".join(value), sep="\t")
 
-def interactive_mode(db, reverse):
+
+# Prints each word of text with the lemmas it could be a form of, e.g.:
+#   Hwæt: hwæt (pronoun); hwæt (adjective)
+def lemmatize(db, text):
+    for token, entries in db.lemmatize(text):
+        lemmas = "; ".join(
+            f"{entry.lemma} ({', '.join(entry.word_type_labels)})"
+            for entry in entries
+        )
+        print(f"{token}: {lemmas or '?'}")
+
+
+def interactive_mode(db, args):
     while True:
         try:
             search_str = input("> ").strip()
         except (KeyboardInterrupt, EOFError):
             print()
             break
-        lookup(db, search_str, reverse)
+        lookup(db, search_str, args)
 
 
-def lookup(db, search_str, reverse):
-    if reverse:
-        entries = db.reverse_lookup(search_str)
-    else:
-        entries = db.lookup(search_str)
-    if len(entries) == 0:
-        print("Not found:", search_str, "\n")
+def lookup(db, search_str, args):
+    if args.complete:
+        for form, lemma, word_type in db.complete(search_str, args.limit or lexdb.COMPLETION_LIMIT):
+            print(f"{form} ({lemma}: {lexicon.expand_word_type(word_type)})")
+        print()
+        return
+    if args.browse:
+        browse(db, search_str, args)
+        return
+    if args.paradigm:
+        print_paradigms(db, search_str)
+        return
+    if args.reverse:
+        reverse(db, search_str, args)
+        return
+    results = db.lookup_forms(search_str)
+    if len(results) == 0:
+        print("Not found:", search_str)
+        suggestions = db.suggest(search_str)
+        if suggestions:
+            lemmas = dict.fromkeys(entry.lemma for entry in suggestions)
+            print("Did you mean:", ", ".join(lemmas) + "?")
+        print()
     else:
-        for entry in entries:
-            types = "; ".join(lexicon.expand_word_type(word_type) for word_type in entry.word_types)
-            print(f"{entry.lemma}: {types}")
-            print(textwrap.indent(entry.text, " "*4))
+        print_entries([entry for entry, matches in results], dict(results))
+
+
+# forms maps entries to the forms that were looked up (see
+# LexDB.lookup_forms()), whose names are shown after the word types, e.g.:
+#   cyning: masculine strong noun [nom.pl, acc.pl]
+def print_entries(entries, forms=None):
+    forms = forms or {}
+    for entry in entries:
+        types = "; ".join(entry.word_type_labels)
+        names = dict.fromkeys(
+            name for word_type, name, form in forms.get(entry, ()) if name != 'invariable'
+        )
+        if names:
+            types += f" [{', '.join(names)}]"
+        print(f"{entry.lemma}: {types}")
+        print(indent(entry.text, " "*4))
+
+
+# Prints the inflection table of each word type of each entry with word as
+# a form, marking the forms spelled like word with *, e.g.:
+#   cyning: masculine strong noun
+#       nom.sg  cyning
+#       ...
+#       nom.pl  cyningas *
+def print_paradigms(db, word):
+    tables = db.paradigms(word)
+    if not tables:
+        print("Not found:", word)
+    for lemma, word_type, label, table in tables:
+        print(f"{lemma}: {label}")
+        width = max(len(name) for name, forms, matched in table)
+        for name, forms, matched in table:
+            print(f"    {name:{width}}  {', '.join(forms)}{' *' if matched else ''}")
+    print()
+
+
+# Prints the entries a reverse lookup finds as they're read, rather than
+# after all of them have been, followed by the option to get the next page
+# with if there's a limit and there are more. A limit of 0 or less means
+# no limit.
+def reverse(db, search_str, args):
+    limit = args.limit if args.limit is None or args.limit > 0 else None
+    try:
+        results = db.iter_reverse_lookup(search_str, None if limit is None else limit + 1, args.offset, args.cursor)
+        found = 0
+        last_cursor = None
+        for entry, cursor in results:
+            if found == limit:
+                break
+            found += 1
+            last_cursor = cursor
+            print_entries([entry])
+        else:
+            last_cursor = None
+    except ValueError as err:
+        print(err)
+        return
+    if found == 0:
+        print("Not found:", search_str)
+        print()
+    elif last_cursor is not None:
+        import shlex
+        # Ranks are negative, so the cursor has to be attached to the option
+        # (and browse() prints its cursors the same way)
+        print(f"More: --cursor={shlex.quote(last_cursor)} ({db.count_reverse_lookup(search_str)} in all)")
+        print()
+
+
+# Prints a page of entries in alphabetical order, followed by the option to
+# get the next page with
+def browse(db, start, args):
+    try:
+        entries, cursor = db.browse(start, args.cursor, args.limit or lexdb.BROWSE_LIMIT)
+    except ValueError as err:
+        print(err)
+        return
+    print_entries(entries)
+    if cursor is not None:
+        import shlex
+        print(f"More: --cursor={shlex.quote(cursor)}")
+    print()
+
+
+# Same as textwrap.indent(), which would take longer to import than to
+# write
+def indent(text, prefix):
+    return "".join(prefix + line if line.strip() else line for line in text.splitlines(True))
 
@@ -0,0 +1,249 @@
+# Compiled lexicons: a read-only binary file with everything LexDB.lookup()
+# needs, made from a database (see compile_lexicon()) and read through mmap.
+# Looking a word up is a binary search of the file's keys followed by
+# reading the records of the entries, without any SQL, and every process
+# that opens the file shares the one copy of it in the page cache.
+#
+# The file is laid out as:
+#   - a header (see HEADER)
+#   - key offsets: num_keys + 1 offsets into the key data
+#   - posting offsets: num_keys + 1 offsets into the postings
+#   - postings: the ids of the entries found under each key, in the order
+#     LexDB.find_ids() returns them
+#   - key data: every normalized word that lookups can find, encoded as
+#     UTF-8, in sorted order
+#   - record offsets: num_ids + 1 offsets into the record data, where
+#     num_ids is one more than the largest entry id (ids that aren't used
+#     have empty records)
+#   - record data: each entry's record (see encode_entry())
+# All the numbers are unsigned 32-bit ints in the byte order of the machine
+# that compiled the file; MAGIC includes the byte order, so a file from a
+# machine with the other byte order just gets compiled again.
+
+import array
+import itertools
+import mmap
+import os
+import struct
+import sys
+
+from . import lexicon
+
+
+MAGIC = b'OEDLEX1' + (b'L' if sys.byteorder == 'little' else b'B')
+
+# magic, the build id of the database the file was compiled from, the size
+# of the file, num_keys, num_ids, and the position in the file of each of
+# the other sections in order
+HEADER = struct.Struct('=8s32s9I')
+
+# The number of word types and of specials in a record. This is followed by
+# the length (in characters) of each of the record's strings, and then the
+# strings themselves, one after another, encoded as UTF-8 (see
+# encode_entry()).
+RECORD_HEADER = struct.Struct('=HH')
+
+# How many words (or entries) compile_lexicon() reads from the database at
+# a time
+COMPILE_BATCH_SIZE = 5000
+
+
+def compiled_filename(db_filename):
+    return os.path.splitext(db_filename)[0] + '.bin'
+
+
+# Returns a CompiledLexicon for db (a LexDB), compiling it first if there
+# isn't one yet or the one there is was compiled from some other build of
+# the database
+def load(db):
+    filename = compiled_filename(db.db_filename)
+    try:
+        compiled = CompiledLexicon(filename)
+    except (OSError, ValueError):
+        pass
+    else:
+        if compiled.build_id == db.build_id:
+            return compiled
+        compiled.close()
+    return compile_lexicon(db, filename)
+
+
+# Compiles the database db (a LexDB) to filename, and returns it opened
+# The file is written to a temporary file which is then renamed, for the
+# same reasons as in LexDB.gen_db(). Processes that have the old file open
+# carry on reading it undisturbed.
+def compile_lexicon(db, filename):
+    # Words and entries are read COMPILE_BATCH_SIZE at a time so that a big
+    # lexicon doesn't have to be held in memory all at once
+    words = sorted(word.encode() for (word,) in db.conn.execute("SELECT word FROM vocabulary"))
+    key_offsets = array.array('I', [0])
+    posting_offsets = array.array('I', [0])
+    postings = array.array('I')
+    for start in range(0, len(words), COMPILE_BATCH_SIZE):
+        batch = [key.decode() for key in words[start:start+COMPILE_BATCH_SIZE]]
+        found = db.find_ids_many(batch)
+        for word in batch:
+            postings.extend(found[word])
+            posting_offsets.append(len(postings))
+    for key in words:
+        key_offsets.append(key_offsets[-1] + len(key))
+    key_data = b"".join(words)
+    del words
+
+    ids = [id for (id,) in db.conn.execute("SELECT id FROM entries ORDER BY id")]
+    num_ids = ids[-1] + 1 if ids else 0
+    record_offsets = array.array('I', [0] * (num_ids + 1))
+    record_data = bytearray()
+    for start in range(0, len(ids), COMPILE_BATCH_SIZE):
+        batch = ids[start:start+COMPILE_BATCH_SIZE]
+        for id, entry in zip(batch, db.fetch_entries(batch)):
+            record_data += encode_entry(entry)
+            record_offsets[id + 1] = len(record_data)
+    # Unused ids get empty records
+    for id in range(num_ids):
+        record_offsets[id + 1] = max(record_offsets[id], record_offsets[id + 1])
+
+    sections = [
+        key_offsets.tobytes(),
+        posting_offsets.tobytes(),
+        postings.tobytes(),
+        key_data,
+        record_offsets.tobytes(),
+        record_data,
+    ]
+    positions = []
+    size = HEADER.size
+    for section in sections:
+        positions.append(size)
+        size += len(section)
+
+    dirname, basename = os.path.split(filename)
+    import tempfile
+    tmpfile, tmp_filename = tempfile.mkstemp(".tmp", f"{basename}-", dirname or ".")
+    try:
+        with os.fdopen(tmpfile, 'wb') as outfile:
+            outfile.write(HEADER.pack(
+                MAGIC, db.build_id.encode(), size, len(key_offsets) - 1, num_ids, *positions
+            ))
+            for section in sections:
+                outfile.write(section)
+        os.chmod(tmp_filename, 0o664)
+        compiled = CompiledLexicon(tmp_filename)
+        os.rename(tmp_filename, filename)
+    except:
+        try:
+            os.remove(tmp_filename)
+        except:
+            pass
+        raise
+    return compiled
+
+
+# Encodes the parts of an entry that LexDB.fetch_entries() returns as a
+# record for the record data
+def encode_entry(entry):
+    strings = [entry.lemma, entry.text, entry.definition_html]
+    strings += entry.word_types
+    strings += entry.word_type_labels
+    for key, value in entry.special.items():
+        strings += [key, value]
+    return b"".join([
+        RECORD_HEADER.pack(len(entry.word_types), len(entry.special)),
+        array.array('I', map(len, strings)).tobytes(),
+        "".join(strings).encode(),
+    ])
+
+
+# An open compiled lexicon. find_ids_many() and fetch_entries() return
+# exactly what LexDB's methods of the same names would for the database it
+# was compiled from.
+# Any number of threads can use it at once. Like a MemoryImage, the file is
+# unmapped once nothing is using it.
+class CompiledLexicon(object):
+    def __init__(self, filename):
+        self.mm = None
+        self.view = None
+        with open(filename, 'rb') as infile:
+            self.mm = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < HEADER.size:
+            raise ValueError(f"Not a compiled lexicon: {filename}")
+        (magic, build_id, size, self.num_keys, self.num_ids, key_offsets_pos,
+         posting_offsets_pos, postings_pos, self.keys_pos, record_offsets_pos,
+         self.records_pos) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or size != len(self.mm):
+            raise ValueError(f"Not a compiled lexicon (or from another machine): {filename}")
+        self.build_id = build_id.decode()
+        # These are views of the file itself, so nothing is copied
+        view = memoryview(self.mm)
+        self.key_offsets = view[key_offsets_pos:posting_offsets_pos].cast('I')
+        self.posting_offsets = view[posting_offsets_pos:postings_pos].cast('I')
+        self.postings = view[postings_pos:self.keys_pos].cast('I')
+        self.record_offsets = view[record_offsets_pos:self.records_pos].cast('I')
+        self.view = view
+
+    def close(self):
+        self.key_offsets = self.posting_offsets = self.postings = self.record_offsets = None
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    # Returns the number of the key in the key data, or None if it isn't
+    # there (a binary search)
+    def find_key(self, key):
+        lo = 0
+        hi = self.num_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.keys_pos + self.key_offsets[mid]
+            end = self.keys_pos + self.key_offsets[mid + 1]
+            if self.mm[start:end] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_keys:
+            start = self.keys_pos + self.key_offsets[lo]
+            end = self.keys_pos + self.key_offsets[lo + 1]
+            if self.mm[start:end] == key:
+                return lo
+        return None
+
+    def find_ids_many(self, words):
+        results = {}
+        for word in words:
+            num = self.find_key(word.encode())
+            if num is None:
+                results[word] = []
+            else:
+                results[word] = self.postings[self.posting_offsets[num]:self.posting_offsets[num + 1]].tolist()
+        return results
+
+    def fetch_entries(self, ids):
+        return [self.fetch_entry(id) for id in ids]
+
+    def fetch_entry(self, id):
+        if not 0 <= id < self.num_ids or self.record_offsets[id] == self.record_offsets[id + 1]:
+            raise KeyError(id)
+        start = self.records_pos + self.record_offsets[id]
+        end = self.records_pos + self.record_offsets[id + 1]
+        num_word_types, num_specials = RECORD_HEADER.unpack_from(self.mm, start)
+        num_strings = 3 + 2 * (num_word_types + num_specials)
+        start += RECORD_HEADER.size
+        lengths = self.view[start:start + 4 * num_strings].cast('I')
+        text = str(self.view[start + 4 * num_strings:end], 'utf-8')
+        bounds = list(itertools.accumulate(lengths, initial=0))
+        strings = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+        lemma, definition, definition_html = strings[:3]
+        word_types = strings[3:3 + num_word_types]
+        labels = strings[3 + num_word_types:3 + 2 * num_word_types]
+        special = strings[3 + 2 * num_word_types:]
+        return lexicon.Entry(
+            lemma,
+            word_types,
+            dict(zip(special[::2], special[1::2])),
+            definition,
+            definition_html=definition_html,
+            word_type_labels=labels
+        )
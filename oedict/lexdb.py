@@ -1,47 +1,289 @@
+import contextlib
+import functools
+import math
 import os
 import re
-import tempfile
+import threading
+import time
+import weakref
 
 import sqlite3
 
+from . import lexbin
 from . import lexicon
 
 
-SCHEMA = """
+# Bump this whenever SCHEMA changes so that databases built by older
+# versions get regenerated
+SCHEMA_VERSION = 12
+
+# The tables keyed on entry id are WITHOUT ROWID tables whose primary key
+# covers every column, so fetching an entry's word types or specials is a
+# single range read of one b-tree.
+SCHEMA = f"""
 PRAGMA foreign_keys = ON;
+PRAGMA user_version = {SCHEMA_VERSION};
+
+-- Information about how the database was built: 'index_mode', plus
+-- 'build_id' (a random identifier that changes every time the database is
+-- generated or updated) and 'build_time' (when that happened, in seconds
+-- since the epoch)
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
 
+-- seq is the entry's position in the lexicon file. This is the same as
+-- the id after a full rebuild, but not after an incremental one.
+-- hash is lexicon.content_hash(entry), which incremental rebuilds use to
+-- tell which entries have changed.
+-- definition_html is the definition rendered from Markdown to HTML.
+-- collation_key is lexicon.collation_key(lemma), for going through the
+-- entries in alphabetical order (see LexDB.browse()).
 CREATE TABLE entries (
-    id INT PRIMARY KEY,
+    id INTEGER PRIMARY KEY,
     lemma TEXT NOT NULL,
-    definition TEXT NOT NULL
+    definition TEXT NOT NULL,
+    seq INT NOT NULL,
+    hash TEXT NOT NULL,
+    definition_html TEXT NOT NULL,
+    collation_key TEXT NOT NULL
 );
 
+CREATE INDEX entries_by_seq ON entries(seq);
+CREATE INDEX entries_by_collation_key ON entries(collation_key, seq);
+
+-- label is lexicon.expand_word_type(word_type)
 CREATE TABLE word_types (
     id INT NOT NULL,
     word_type TEXT NOT NULL,
-    UNIQUE(id, word_type)
-);
+    label TEXT NOT NULL,
+    PRIMARY KEY(id, word_type)
+) WITHOUT ROWID;
 
 CREATE TABLE specials (
     id INT NOT NULL,
     key TEXT NOT NULL,
     value TEXT NOT NULL,
-    UNIQUE(id, key, value)
-);
+    PRIMARY KEY(id, key, value)
+) WITHOUT ROWID;
 
+-- Only one of lex_index and fold_index is filled in, depending on the
+-- index mode (see lexicon.INDEX_MODES).
+-- lex_index maps the normalized spelling of each variant of each form to
+-- the entries it belongs to.
 CREATE TABLE lex_index (
     word TEXT NOT NULL,
     entry_id INT REFERENCES entries(id) NOT NULL,
-    UNIQUE(word, entry_id)
+    PRIMARY KEY(word, entry_id)
+) WITHOUT ROWID;
+
+-- fold_index has each form of each entry once, keyed by lexicon.fold() of
+-- its normalized spelling
+CREATE TABLE fold_index (
+    key TEXT NOT NULL,
+    form TEXT NOT NULL,
+    entry_id INT REFERENCES entries(id) NOT NULL,
+    PRIMARY KEY(key, form, entry_id)
+) WITHOUT ROWID;
+
+-- Every form of every entry, keyed by lexicon.normalize_prefix(form), for
+-- completing words as they're typed (see LexDB.complete()). inflected is
+-- 0 if the form is the lemma so that lemmas come first.
+CREATE TABLE completions (
+    key TEXT NOT NULL,
+    inflected INT NOT NULL,
+    form TEXT NOT NULL,
+    entry_id INT REFERENCES entries(id) NOT NULL,
+    word_type TEXT NOT NULL,
+    PRIMARY KEY(key, inflected, form, entry_id, word_type)
+) WITHOUT ROWID;
+
+-- Every form of every entry, as generated by lexicon.gen_forms(), so that
+-- inflection tables and the forms a lookup matched can be shown without
+-- generating them again. form_name is the name of the form, such as
+-- 'gen.sg' or 'past.pl', and num is the form's position in the paradigm of
+-- the word type (forms of the same name come one after the other). key is
+-- the normalized spelling of the form. Forms given as '-' (i.e. that don't
+-- exist) are left out.
+CREATE TABLE forms (
+    entry_id INT REFERENCES entries(id) NOT NULL,
+    word_type TEXT NOT NULL,
+    num INT NOT NULL,
+    form_name TEXT NOT NULL,
+    form TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY(entry_id, word_type, num)
+) WITHOUT ROWID;
+
+CREATE INDEX forms_by_key ON forms(key, entry_id);
+
+-- Every word that lookups can find (i.e. every word in lex_index, or every
+-- variant of every form in fold_index), for suggesting corrections
+CREATE TABLE vocabulary (
+    word TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+-- Deletion index for suggesting corrections (see LexDB.suggest()). Maps
+-- each word in the vocabulary, and each spelling made by deleting one
+-- letter from it, to the word.
+CREATE TABLE fuzzy (
+    deletion TEXT NOT NULL,
+    word TEXT NOT NULL,
+    PRIMARY KEY(deletion, word)
+) WITHOUT ROWID;
+
+-- Dense numbering of the entries that random lookups can pick (those that
+-- aren't redirects), in lexicon order, so that picking one is a single
+-- primary key read (see LexDB.random_lookup()). part_of_speech is '' for
+-- the numbering of all of them, and otherwise numbers just the ones with a
+-- word type of that part of speech (see lexicon.part_of_speech()). num
+-- counts from 0 up to the count in random_counts.
+CREATE TABLE random_entries (
+    part_of_speech TEXT NOT NULL,
+    num INT NOT NULL,
+    entry_id INT REFERENCES entries(id) NOT NULL,
+    PRIMARY KEY(part_of_speech, num)
+) WITHOUT ROWID;
+
+CREATE TABLE random_counts (
+    part_of_speech TEXT PRIMARY KEY,
+    count INT NOT NULL
+) WITHOUT ROWID;
+
+-- Full-text index of definitions for reverse lookups. The text itself is
+-- read from the entries table. Redirects ("SEE ...") aren't indexed.
+CREATE VIRTUAL TABLE definitions USING fts5(
+    definition,
+    content='entries',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3'
 );
 """
 
+# Maximum number of ids to put in a single "IN (...)" clause. SQLite has a
+# limit on the number of parameters in a statement, which is as low as 999
+# in older versions.
+BATCH_SIZE = 500
+
+# Size of the first batch of rows LexDB.iter_query() reads. Later batches
+# double in size up to BATCH_SIZE.
+FIRST_BATCH_SIZE = 20
+
+# How long (in seconds) the lexicon has to be left alone before a LexDBPool
+# regenerates the database from it
+SETTLE_TIME = 2
+
+# Maximum number of results LexDB.complete() returns by default
+COMPLETION_LIMIT = 10
+
+# Maximum edit distance of suggested corrections (see LexDB.suggest()).
+# Words shorter than SHORT_WORD_LENGTH only get suggestions one edit away.
+MAX_EDIT_DISTANCE = 2
+SHORT_WORD_LENGTH = 5
+
+# Maximum number of entries LexDB.suggest() returns by default
+SUGGESTION_LIMIT = 5
+
+# Number of entries on each page of LexDB.browse() by default
+BROWSE_LIMIT = 20
+
+# Selects each word in the table {words} along with every spelling made by
+# deleting one letter from it, as (deletion, word) pairs for the fuzzy table
+FUZZY_DELETIONS_SQL = """
+WITH RECURSIVE pos(n) AS (
+    SELECT 1 UNION ALL SELECT n + 1 FROM pos
+    WHERE n < (SELECT MAX(length(word)) FROM {words})
+)
+SELECT word, word FROM {words}
+UNION
+SELECT substr(word, 1, n - 1) || substr(word, n + 1), word
+FROM {words} JOIN pos ON n <= length(word)
+"""
+
+# Matches a word in a passage to be lemmatized (see LexDB.lemmatize()),
+# including words joined by hyphens
+TOKEN_RE = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*|⁊")
+
+REDIRECT_RE = re.compile(r"^SEE(?:\s+?)(.+)")
+
+# Matches either a quoted phrase or a single search term
+SEARCH_TERM_RE = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+# Decorates a LexDB method so that the time it takes is added to the named
+# phase of the LexDB's stats, if it has any (see Stats). Without stats this
+# only costs an attribute check.
+def timed(phase):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.add_time(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
 
 class LexDB(object):
-    def __init__(self, lex_filename, db_filename):
+    # If check_outdated is False, the database is assumed to be up to date
+    # (e.g. because a LexDBPool has already checked it)
+    # If in_memory is True, the whole database is copied into memory when
+    # it's opened (see MemoryImage) rather than read from the file as
+    # needed. image is a MemoryImage to use instead of making a new copy,
+    # which is how a LexDBPool shares one copy between all its connections.
+    # mmap_size and cache_size set the SQLite pragmas of the same names (a
+    # negative cache_size is in KiB rather than pages).
+    # If compiled is True, lookups read a compiled lexicon (see lexbin)
+    # instead of the database, compiling it first if need be. Everything else
+    # still uses the database, and the results are the same either way.
+    # compiled_lexicon is a lexbin.CompiledLexicon to use instead of loading
+    # one, which is how a LexDBPool shares one between all its connections.
+    # build_options are passed to gen_db() if the database is out of date
+    # stats can be set to a Stats object to record what the LexDB does
+    def __init__(self, lex_filename, db_filename, check_outdated=True,
+                 in_memory=False, image=None, mmap_size=None, cache_size=None,
+                 compiled=False, compiled_lexicon=None, **build_options):
         self.conn = None
-        self.gen_db_if_outdated(lex_filename, db_filename)
-        self.conn = sqlite3.connect(f'file:{db_filename}?mode=ro', uri=True)
+        self.image = None
+        self.compiled_lexicon = None
+        self.random_counts = None
+        self.stats = None
+        self.db_filename = db_filename
+        if check_outdated:
+            self.gen_db_if_outdated(lex_filename, db_filename, **build_options)
+        if in_memory and image is None:
+            image = MemoryImage(db_filename)
+        # check_same_thread is off so that a LexDBPool can close connections
+        # belonging to other threads; a LexDB still shouldn't be used by more
+        # than one thread at a time
+        if image is not None:
+            self.image = image
+            self.conn = sqlite3.connect(image.uri, uri=True, check_same_thread=False)
+            self.conn.execute("PRAGMA query_only = ON")
+        else:
+            self.conn = sqlite3.connect(
+                f'file:{db_filename}?mode=ro',
+                uri=True,
+                check_same_thread=False
+            )
+        if mmap_size is not None:
+            self.conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+        if cache_size is not None:
+            self.conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self.index_mode = meta['index_mode']
+        self.build_id = meta['build_id']
+        self.build_time = int(meta['build_time'])
+        if compiled and compiled_lexicon is None:
+            compiled_lexicon = lexbin.load(self)
+        self.compiled_lexicon = compiled_lexicon
 
     def __enter__(self):
         return self
@@ -56,9 +298,27 @@ class LexDB(object):
         if self.conn is not None:
             self.conn.close()
             self.conn = None
+        # The copy in memory (and the compiled lexicon) are freed once
+        # nothing is using them
+        self.image = None
+        self.compiled_lexicon = None
 
-    def gen_db(self, lex_filename, db_filename):
-        lex = lexicon.Lexicon(lex_filename)
+    # If incremental is True, an existing database is updated with only the
+    # entries that have changed rather than regenerated from scratch
+    # jobs is the number of processes to use to generate the index and the
+    # rows of the entries
+    # index_mode is one of lexicon.INDEX_MODES. If it's None, the index mode
+    # of the existing database is kept (or 'variants' if there isn't one).
+    @classmethod
+    def gen_db(cls, lex_filename, db_filename, incremental=False, jobs=1, index_mode=None):
+        old_index_mode = read_index_mode(db_filename)
+        if index_mode is None:
+            index_mode = old_index_mode or 'variants'
+        lex = lexicon.Lexicon(lex_filename, gen_index=False, index_mode=index_mode)
+        if incremental and index_mode == old_index_mode:
+            gen_impl = lambda filename: cls.gen_db_incremental_impl(lex, db_filename, filename, jobs)
+        else:
+            gen_impl = lambda filename: cls.gen_db_impl(lex, filename, jobs)
         # Write the new database to a temporary file, then move it to the
         # desired location. This way it should be friendly to concurrent
         # processes, and should still do the Right Thing when two processes
@@ -66,11 +326,12 @@ class LexDB(object):
         # in the same directory as its final location in case /tmp is on
         # another filesystem; this way the move should be atomic.
         dirname, basename = os.path.split(db_filename)
+        import tempfile
         tmpfile, tmp_filename = tempfile.mkstemp(".tmp", f"{basename}-", dirname)
         os.close(tmpfile)       # sqlite3 will reopen it
         os.chmod(tmp_filename, 0o664)
         try:
-            self.gen_db_impl(lex, tmp_filename)
+            gen_impl(tmp_filename)
             os.rename(tmp_filename, db_filename)
         except:
             # Something went wrong; delete our temporary file
@@ -80,108 +341,1130 @@ class LexDB(object):
                 pass
             raise
 
-    def gen_db_if_outdated(self, lex_filename, db_filename):
-        # Generate new database file if it's out of date
+    @classmethod
+    def gen_db_if_outdated(cls, lex_filename, db_filename, **build_options):
+        # Generate new database file if it's out of date (or was built with
+        # a different index mode from the one asked for)
         # If it's up-to-date, just use that instead
-        lex_time = os.stat(lex_filename).st_mtime
-        try:
-            db_time = os.stat(db_filename).st_mtime
-        except FileNotFoundError:
-            db_time = 0
-        if lex_time > db_time:
-            self.gen_db(lex_filename, db_filename)
+        # Returns True if the database was regenerated
+        index_mode = build_options.get('index_mode')
+        if is_outdated(lex_filename, db_filename) \
+                or (index_mode is not None and index_mode != read_index_mode(db_filename)):
+            cls.gen_db(lex_filename, db_filename, **build_options)
+            return True
+        return False
 
-    def gen_db_impl(self, lex, filename):
+    # lex is read with gen_index False: its index is generated here, along
+    # with the rows of its entries, by jobs processes
+    @staticmethod
+    def gen_db_impl(lex, filename, jobs=1):
+        prepared = lexicon.index_entries(lex.entries, jobs, lex.index_mode, prepare_entry)
+        index = lexicon.Index([words for words, rows in prepared])
         conn = sqlite3.connect(filename)
         try:
             cur = conn.cursor()
             cur.executescript(SCHEMA)
-            ids = {}
+            cur.execute("INSERT INTO meta VALUES ('index_mode', ?)", (lex.index_mode,))
+            stamp_build(cur)
+            for num, (entry, (words, rows)) in enumerate(zip(lex.entries, prepared)):
+                insert_entry(cur, num + 1, num + 1, entry, rows)
+            for word, nums in index.items():
+                insert_index(cur, lex.index_mode, word, (num + 1 for num in nums))
+            update_fuzzy_index(cur, lex.index_mode)
+            update_random_entries(cur)
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Updates a copy of the database in old_filename to match the lexicon,
+    # writing the result to filename. Only entries that were added or
+    # changed since the old database was built have their forms generated;
+    # the rows of entries that were changed or removed are deleted.
+    @staticmethod
+    def gen_db_incremental_impl(lex, old_filename, filename, jobs=1):
+        old_conn = sqlite3.connect(f'file:{old_filename}?mode=ro', uri=True)
+        conn = sqlite3.connect(filename)
+        try:
+            old_conn.backup(conn)
+            old_conn.close()
+            cur = conn.cursor()
+            # Entries with the same content have the same hash, so map each
+            # hash to a list of ids
+            old_ids = {}
+            old_seqs = {}
+            for id, seq, hash in cur.execute("SELECT id, seq, hash FROM entries ORDER BY id"):
+                old_ids.setdefault(hash, []).append(id)
+                old_seqs[id] = seq
+            added = []
+            moved = []
             for num, entry in enumerate(lex.entries):
-                id = num + 1
-                ids[entry] = id
-                cur.execute(
-                    "INSERT INTO entries VALUES (?, ?, ?)",
-                    (id, entry.lemma, entry.text)
-                )
-                cur.executemany(
-                    "INSERT INTO word_types VALUES (?, ?)",
-                    ((id, word_type) for word_type in entry.word_types)
-                )
-                for key, values in entry.special.items():
-                    cur.executemany(
-                        "INSERT INTO specials VALUES (?, ?, ?)",
-                        ((id, key, value) for value in values)
-                    )
-            for word, entries in lex.index.items():
-                cur.executemany(
-                    "INSERT INTO lex_index VALUES (?, ?)",
-                    ((word, ids[entry]) for entry in entries)
-                )
+                seq = num + 1
+                ids = old_ids.get(lexicon.content_hash(entry))
+                if ids:
+                    id = ids.pop(0)
+                    if old_seqs[id] != seq:
+                        moved.append((seq, id))
+                else:
+                    added.append((seq, entry))
+            removed = [id for ids in old_ids.values() for id in ids]
+            delete_entries(cur, removed)
+            cur.executemany("UPDATE entries SET seq = ? WHERE id = ?", moved)
+            next_id = cur.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM entries").fetchone()[0]
+            prepared = lexicon.index_entries([entry for seq, entry in added], jobs, lex.index_mode, prepare_entry)
+            for (seq, entry), (words, rows) in zip(added, prepared):
+                id = next_id
+                next_id += 1
+                insert_entry(cur, id, seq, entry, rows)
+                for word in words:
+                    insert_index(cur, lex.index_mode, word, (id,))
+            update_fuzzy_index(cur, lex.index_mode)
+            update_random_entries(cur)
+            stamp_build(cur)
             conn.commit()
         finally:
+            old_conn.close()
             conn.close()
 
+    # Runs a read-only query and returns all of its rows, counting the
+    # statement and rows in self.stats
+    def query(self, sql, params=()):
+        rows = self.conn.execute(sql, params).fetchall()
+        if self.stats is not None:
+            self.stats.statements += 1
+            self.stats.rows += len(rows)
+        return rows
+
+    # Like query(), but yields the rows in batches as they're read, so that
+    # only a batch of rows is in memory at once. The first batch is
+    # FIRST_BATCH_SIZE rows, so that the first rows come out quickly, and
+    # each batch after that is twice the size of the last, up to BATCH_SIZE.
+    def iter_query(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        if self.stats is not None:
+            self.stats.statements += 1
+        size = FIRST_BATCH_SIZE
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                return
+            if self.stats is not None:
+                self.stats.rows += len(rows)
+            yield rows
+            size = min(size * 2, BATCH_SIZE)
+
     def lookup(self, word):
+        return self.lookup_many([word])[word]
+
+    # Looks up many words at once, returning a dict mapping each word to what
+    # lookup() would return for it. Every word (and every word redirected
+    # to) is resolved in the same batched queries, so this takes a handful
+    # of queries per BATCH_SIZE distinct words and level of redirects,
+    # rather than several queries per word.
+    def lookup_many(self, words):
+        ids, entries = self._lookup_ids_many(words)
+        return {word: [entries[id] for id in id_list] for word, id_list in ids.items()}
+
+    # Does the work of lookup_many(): returns a dict mapping each word to
+    # the ids of the entries lookup() would return for it, and a dict
+    # mapping those ids to the entries
+    def _lookup_ids_many(self, words):
+        keys = {word: lexicon.normalize(word) for word in words}
+        ids = {}
+        entries = {}
+        pending = set(keys.values())
+        depth = -1
+        while pending:
+            depth += 1
+            found = self.find_ids_many(pending)
+            ids.update(found)
+            new_ids = list(dict.fromkeys(
+                id for id_list in found.values() for id in id_list if id not in entries
+            ))
+            entries.update(zip(new_ids, self.fetch_entries(new_ids)))
+            pending = set()
+            for id in new_ids:
+                matches = REDIRECT_RE.match(entries[id].text)
+                if matches:
+                    target = lexicon.normalize(matches.group(1))
+                    if target not in ids:
+                        pending.add(target)
+
+        def collect(key, results, seen):
+            for id in ids[key]:
+                entry = entries[id]
+                if entry not in seen:
+                    seen.add(entry)
+                    results.append(id)
+                    matches = REDIRECT_RE.match(entry.text)
+                    if matches:
+                        # Follow redirect
+                        collect(lexicon.normalize(matches.group(1)), results, seen)
+
+        results = {}
+        for word, key in keys.items():
+            results[word] = []
+            collect(key, results[word], set())
+        if self.stats is not None:
+            self.stats.redirect_depth = max(self.stats.redirect_depth, depth)
+            self.stats.results += sum(len(x) for x in results.values())
+        return results, entries
+
+    # Like lookup(), but returns (entry, forms) pairs, where forms are the
+    # forms of the entry spelled like word (after normalization, as in
+    # paradigms()), as (word type, form name, form) tuples. Entries that
+    # were only found through another spelling variant or by following a
+    # redirect have no forms.
+    def lookup_forms(self, word):
+        ids, entries = self._lookup_ids_many([word])
+        matches = {}
+        rows = self.query(
+            "SELECT entry_id, word_type, form_name, form FROM forms"
+            " WHERE key = ? ORDER BY entry_id, word_type, num",
+            (lexicon.normalize(word),)
+        )
+        for id, word_type, form_name, form in rows:
+            matches.setdefault(id, []).append((word_type, form_name, form))
+        return [(entries[id], matches.get(id, [])) for id in ids[word]]
+
+    # Returns the inflection tables of the entries with a form spelled like
+    # word (after normalization, but not counting other spelling variants)
+    # as (lemma, word type, label, rows) tuples, where rows are (form name,
+    # forms, matched) tuples in the order lexicon.gen_forms() gives them,
+    # and matched is whether one of the forms is spelled like word.
+    # The forms are read from the forms table in a single indexed query, so
+    # nothing is generated.
+    @timed('paradigm')
+    def paradigms(self, word):
+        key = lexicon.normalize(word)
+        rows = self.query(
+            "SELECT forms.entry_id, lemma, forms.word_type, label, form_name, form, key"
+            " FROM forms JOIN entries ON entries.id = forms.entry_id"
+            " JOIN word_types ON word_types.id = forms.entry_id AND word_types.word_type = forms.word_type"
+            " WHERE forms.entry_id IN (SELECT entry_id FROM forms WHERE key = ?)"
+            " ORDER BY seq, forms.word_type, num",
+            (key,)
+        )
         results = []
-        self._lookup_impl(word, results)
+        last = None
+        for id, lemma, word_type, label, form_name, form, form_key in rows:
+            if (id, word_type) != last:
+                last = id, word_type
+                results.append((lemma, word_type, label, []))
+            table = results[-1][3]
+            if not table or table[-1][0] != form_name:
+                table.append([form_name, [], False])
+            table[-1][1].append(form)
+            table[-1][2] = table[-1][2] or form_key == key
+        if self.stats is not None:
+            self.stats.results += len(results)
+        return [
+            (lemma, word_type, label, [tuple(row) for row in table])
+            for lemma, word_type, label, table in results
+        ]
+
+    # Looks up every word in text, which can be a string or an iterable of
+    # strings (such as the lines of a file), yielding (token, entries) for
+    # each token in the order they appear. Tokens are looked up BATCH_SIZE
+    # at a time with lookup_many() and each distinct token is only looked up
+    # once, so long texts are processed quickly and the first results come
+    # out before the whole text has been read.
+    def lemmatize(self, text):
+        if isinstance(text, str):
+            text = [text]
+        cache = {}
+        tokens = []
+        for line in text:
+            tokens += TOKEN_RE.findall(line)
+            if len(tokens) >= BATCH_SIZE:
+                yield from self._lemmatize_batch(tokens, cache)
+                tokens = []
+        yield from self._lemmatize_batch(tokens, cache)
+
+    def _lemmatize_batch(self, tokens, cache):
+        new_tokens = [token for token in dict.fromkeys(tokens) if token not in cache]
+        if new_tokens:
+            cache.update(self.lookup_many(new_tokens))
+        for token in tokens:
+            yield token, cache[token]
+
+    # Returns the ids of the entries indexed under a normalized word, in the
+    # order they appear in the lexicon (which isn't necessarily the same as
+    # id order after an incremental rebuild)
+    def find_ids(self, word):
+        return self.find_ids_many([word])[word]
+
+    # Like find_ids(), but for many words at once. Returns a dict mapping
+    # each word to its ids.
+    @timed('find')
+    def find_ids_many(self, words):
+        if self.compiled_lexicon is not None:
+            return self.compiled_lexicon.find_ids_many(words)
+        results = {word: [] for word in words}
+        if self.index_mode == 'fold':
+            # This finds every form each word could be a variant of, and then
+            # some, so check each one
+            keys = {}
+            for word in results:
+                keys.setdefault(lexicon.fold(word), []).append(word)
+            query = (
+                "SELECT key, form, entry_id FROM fold_index JOIN entries ON entries.id = entry_id"
+                " WHERE key IN ({}) ORDER BY seq"
+            )
+            for batch in batches(list(keys)):
+                for key, form, id in self.query(query.format(", ".join("?" * len(batch))), batch):
+                    for word in keys[key]:
+                        if word in lexicon.variant_keys(form) and id not in results[word]:
+                            results[word].append(id)
+            return results
+        query = (
+            "SELECT word, entry_id FROM lex_index JOIN entries ON entries.id = entry_id"
+            " WHERE word IN ({}) ORDER BY seq"
+        )
+        for batch in batches(list(results)):
+            for word, id in self.query(query.format(", ".join("?" * len(batch))), batch):
+                results[word].append(id)
         return results
 
-    def _lookup_impl(self, word, results):
-        cursor = self.conn.cursor()
+    # Returns up to limit entries whose words are spelled most like word,
+    # closest first, for suggesting corrections when a lookup finds nothing
+    # This is a SymSpell-style search: every word within the edit distance
+    # shares a spelling with word once some letters have been deleted from
+    # each, so the candidates can be found with a single indexed query for
+    # the deletions of word (and another for the entries of all of the
+    # candidates). The fuzzy table only has single deletions, so words that
+    # would need two letters deleted to match (such as two substitutions)
+    # aren't found; typos are mostly only one or two letters different in
+    # the first place.
+    @timed('suggest')
+    def suggest(self, word, limit=SUGGESTION_LIMIT):
         word = lexicon.normalize(word)
-        cursor.execute("SELECT entry_id FROM lex_index WHERE word = ?", (word,))
-        entry_ids = [x[0] for x in cursor.fetchall()]
-        entries = [self.fetch_entry(id) for id in entry_ids]
-        for entry in entries:
-            if entry not in results:
-                results.append(entry)
-                matches = re.match(r"^SEE(?:\s+?)(.+)", entry.text)
-                if matches:
-                    # Follow redirect
-                    self._lookup_impl(matches.group(1), results)
+        if not word:
+            return []
+        max_distance = MAX_EDIT_DISTANCE if len(word) >= SHORT_WORD_LENGTH else 1
+        keys = list(deletions(word, max_distance))
+        candidates = set()
+        for start in range(0, len(keys), BATCH_SIZE):
+            batch = keys[start:start+BATCH_SIZE]
+            params = ", ".join("?" * len(batch))
+            candidates.update(x[0] for x in self.query(f"SELECT word FROM fuzzy WHERE deletion IN ({params})", batch))
+        distances = {}
+        for candidate in candidates:
+            distance = edit_distance(word, candidate)
+            if distance <= max_distance:
+                distances[candidate] = distance
+        candidates = sorted(distances, key=lambda x: (distances[x], x))
+        ids_by_word = self.find_ids_many(candidates)
+        # A dict rather than a list, to keep the order without duplicates
+        ids = {}
+        for candidate in candidates:
+            ids.update(dict.fromkeys(ids_by_word[candidate]))
+            if len(ids) >= limit:
+                break
+        results = self.fetch_entries(list(ids)[:limit])
+        if self.stats is not None:
+            self.stats.results += len(results)
+        return results
 
-    # TODO: use FTS? This is what it's made for, but it's quite limited...
-    def reverse_lookup(self, search_string):
-        cursor = self.conn.cursor()
-        search_string = search_string.lower()
-        results = []
-        for row in cursor.execute("SELECT id, definition FROM entries"):
-            id, definition = row
-            if not definition.startswith("SEE"):
-                if search_string in definition.lower():
-                    results.append(self.fetch_entry(id))
+    # Returns up to limit (form, lemma, word type) tuples for the forms
+    # whose normalized spelling begins with that of prefix, in alphabetical
+    # order of normalized spelling (with lemmas before inflected forms).
+    # This is a single range read of the completions table. The spellings
+    # are normalized without the rules for the ends of words, since the end
+    # of the prefix usually isn't the end of the word.
+    @timed('complete')
+    def complete(self, prefix, limit=COMPLETION_LIMIT):
+        prefix = lexicon.normalize_prefix(prefix)
+        if not prefix:
+            return []
+        results = self.query(
+            "SELECT form, lemma, word_type FROM completions JOIN entries ON entries.id = entry_id"
+            " WHERE key >= ? AND key < ?"
+            " ORDER BY key, inflected, form, entry_id, word_type LIMIT ?",
+            (prefix, prefix_successor(prefix), limit)
+        )
+        if self.stats is not None:
+            self.stats.results += len(results)
         return results
 
-    def random_lookup(self):
-        result = self.conn.execute("SELECT id FROM entries WHERE definition NOT GLOB 'SEE *' ORDER BY RANDOM() LIMIT 1")
-        return self.fetch_entry(result.fetchone()[0])
+    # Finds entries whose definitions contain all of the words in
+    # search_string, best matches first. A word ending in * matches any word
+    # beginning with it, and words in double quotes must appear together as
+    # a phrase. Equally good matches are in lexicon order, which (unlike
+    # the ids) is the same after an incremental rebuild as after a full one.
+    def reverse_lookup(self, search_string, limit=None, offset=0, cursor=None):
+        return [entry for entry, _ in self.iter_reverse_lookup(search_string, limit, offset, cursor)]
 
+    # Like reverse_lookup(), but yields the entries as they're read from the
+    # database (see iter_query()), so however many entries match, the first
+    # come out quickly and only a batch of them is in memory at once.
+    # Each entry comes with a cursor that gets the results after it (see
+    # reverse_cursor()), which can be passed back instead of an offset to
+    # carry on from there without reading past the earlier results again.
+    # Only the time spent reading is added to the 'search' phase of the
+    # stats, not the time spent on the results in between.
+    def iter_reverse_lookup(self, search_string, limit=None, offset=0, cursor=None):
+        query = fts_query(search_string)
+        if not query:
+            return
+        sql = (
+            "SELECT definitions.rank, seq, id FROM definitions"
+            " JOIN entries ON id = definitions.rowid"
+            " WHERE definitions MATCH ?"
+        )
+        params = (query,)
+        if cursor is not None:
+            sql += " AND (definitions.rank, seq) > (?, ?)"
+            params += parse_reverse_cursor(cursor)
+        sql += " ORDER BY definitions.rank, seq LIMIT ? OFFSET ?"
+        params += (-1 if limit is None else limit, offset)
+        row_batches = self.iter_query(sql, params)
+        while True:
+            start = time.perf_counter()
+            rows = next(row_batches, None)
+            entries = self.fetch_entries([id for rank, seq, id in rows]) if rows else []
+            if self.stats is not None:
+                self.stats.add_time('search', time.perf_counter() - start)
+                self.stats.results += len(entries)
+            if not rows:
+                return
+            for (rank, seq, id), entry in zip(rows, entries):
+                yield entry, reverse_cursor(rank, seq)
+
+    # Returns how many entries reverse_lookup() would find in all. This
+    # doesn't rank the entries, so it's quicker than finding them.
+    def count_reverse_lookup(self, search_string):
+        query = fts_query(search_string)
+        if not query:
+            return 0
+        return self.query("SELECT count(*) FROM definitions WHERE definitions MATCH ?", (query,))[0][0]
+
+    # Returns a random entry that isn't a redirect, or None if there are no
+    # entries to pick from. The pick is a single read of random_entries.
+    # If seed is given (any str, int, etc.), the same seed always picks the
+    # same entry from the same lexicon, e.g. the date for a word of the day.
+    # weights maps parts of speech (see lexicon.part_of_speech()) to how
+    # likely an entry of that part of speech is to be picked, relative to
+    # the others, e.g. {'noun': 2, 'verb': 1}. Parts of speech that aren't
+    # in weights (or have no entries) aren't picked at all. If the weights
+    # don't add up to a finite number more than 0 (e.g. they're all 0, or
+    # so large that their total overflows), every entry of the parts of
+    # speech in weights is as likely to be picked as any other.
+    @timed('random')
+    def random_lookup(self, seed=None, weights=None):
+        # random is only imported when it's first needed, since it's slow to
+        # import and looking words up doesn't need it
+        import random
+        rng = random.Random(seed)
+        if self.random_counts is None:
+            self.random_counts = dict(self.query("SELECT part_of_speech, count FROM random_counts"))
+        part_of_speech = ''
+        if weights is not None:
+            names = [name for name in weights if name and self.random_counts.get(name)]
+            if not names:
+                return None
+            choices = [(name, weights[name]) for name in names if weights[name] > 0]
+            if not 0 < sum(weight for name, weight in choices) < math.inf:
+                choices = [(name, self.random_counts[name]) for name in names]
+            part_of_speech = rng.choices(
+                [name for name, weight in choices],
+                [weight for name, weight in choices]
+            )[0]
+        count = self.random_counts.get(part_of_speech)
+        if not count:
+            return None
+        result = self.query(
+            "SELECT entry_id FROM random_entries WHERE part_of_speech = ? AND num = ?",
+            (part_of_speech, rng.randrange(count))
+        )
+        if self.stats is not None:
+            self.stats.results += 1
+        return self.fetch_entry(result[0][0])
+
+    # Checks that the lexicon is in alphabetical order, in a single pass
+    # over the stored collation keys in lexicon order
     def check_alphabetization(self):
-        alphabet = "aæbcdefghijklmnopqrstþuvwxyz"
-        xlate = str.maketrans("āǣēīōūȳċġ", "aæeiouycg")
-        lemmas = self.conn.execute("SELECT lemma FROM entries").fetchall()
-        lemmas = [x[0].replace("-", "").lower().translate(xlate) for x in lemmas]
-        sorted_lemmas = sorted(lemmas, key=lambda s: [alphabet.index(ch) for ch in s])
-        for item1, item2 in zip(lemmas, sorted_lemmas):
-            if item1 != item2:
-                print(f"Out of order: {item1} (expected {item2})")
+        prev_lemma = prev_key = None
+        for lemma, key in self.conn.execute("SELECT lemma, collation_key FROM entries ORDER BY seq"):
+            if prev_key is not None and key < prev_key:
+                print(f"Out of order: {lemma} (after {prev_lemma})")
                 return
+            prev_lemma, prev_key = lemma, key
         print("All in order")
 
+    # Returns up to limit entries in alphabetical order (see
+    # lexicon.collation_key()), along with a cursor for the next page (or
+    # None if this is the last one). Each page is a single range read of the
+    # collation key index, however far into the dictionary it is.
+    # The first page starts at the first entry that doesn't come before
+    # start (or at the beginning, if start is empty); the next page is got by
+    # passing the cursor instead (see browse_cursor()).
+    @timed('browse')
+    def browse(self, start="", cursor=None, limit=BROWSE_LIMIT):
+        if limit <= 0:
+            return [], None
+        if cursor is not None:
+            key, seq = parse_browse_cursor(cursor)
+            where = "(collation_key, seq) > (?, ?)"
+            params = (key, seq)
+        else:
+            where = "collation_key >= ?"
+            params = (lexicon.collation_key(start),)
+        rows = self.query(
+            f"SELECT id, seq, lemma FROM entries WHERE {where} ORDER BY collation_key, seq LIMIT ?",
+            params + (limit + 1,)
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            id, seq, lemma = rows[-1]
+            next_cursor = browse_cursor(seq, lemma)
+        results = self.fetch_entries([row[0] for row in rows])
+        if self.stats is not None:
+            self.stats.results += len(results)
+        return results, next_cursor
+
     def fetch_entry(self, id):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT lemma, definition FROM entries WHERE id = ?", (id,))
-        entry = cursor.fetchone()
-        cursor.execute("SELECT word_type FROM word_types WHERE id = ?", (id,))
-        word_types = cursor.fetchall()
-        cursor.execute("SELECT key, value FROM specials WHERE id = ?", (id,))
-        special = cursor.fetchall()
-        return lexicon.Entry(
-            entry[0],
-            [x[0] for x in word_types],
-            {x[0]: x[1] for x in special},
-            entry[1],
-            0
+        return self.fetch_entries([id])[0]
+
+    # Fetches the entries with the given ids, in the same order as the ids.
+    # This takes three queries per BATCH_SIZE ids no matter how many ids
+    # there are, rather than three queries per id.
+    @timed('fetch')
+    def fetch_entries(self, ids):
+        if self.compiled_lexicon is not None:
+            return self.compiled_lexicon.fetch_entries(ids)
+        rows = {}
+        word_types = {}
+        labels = {}
+        special = {}
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), BATCH_SIZE):
+            batch = unique_ids[start:start+BATCH_SIZE]
+            params = ", ".join("?" * len(batch))
+            entry_rows = self.query(f"SELECT id, lemma, definition, definition_html FROM entries WHERE id IN ({params})", batch)
+            for id, lemma, definition, definition_html in entry_rows:
+                rows[id] = (lemma, definition, definition_html)
+            word_type_rows = self.query(f"SELECT id, word_type, label FROM word_types WHERE id IN ({params}) ORDER BY id, word_type", batch)
+            for id, word_type, label in word_type_rows:
+                word_types.setdefault(id, []).append(word_type)
+                labels.setdefault(id, []).append(label)
+            special_rows = self.query(f"SELECT id, key, value FROM specials WHERE id IN ({params}) ORDER BY id, key, value", batch)
+            for id, key, value in special_rows:
+                special.setdefault(id, {})[key] = value
+        return [
+            lexicon.Entry(
+                rows[id][0],
+                word_types.get(id, []),
+                special.get(id, {}),
+                rows[id][1],
+                definition_html=rows[id][2],
+                word_type_labels=labels.get(id, [])
+            )
+            for id in ids
+        ]
+
+
+# Returns what insert_entry() needs besides the entry itself, given its
+# forms (see lexicon.entry_paradigms()). This is the slow part of inserting
+# an entry, so it's passed to lexicon.index_entries() to be done in the
+# same processes as the indexing.
+def prepare_entry(entry, paradigms):
+    return (
+        lexicon.content_hash(entry),
+        render_definition(entry.text),
+        lexicon.collation_key(entry.lemma),
+        paradigms
+    )
+
+
+# Inserts the rows for a single entry, except for its lex_index rows, given
+# what prepare_entry() returned for it
+def insert_entry(cur, id, seq, entry, prepared):
+    hash, definition_html, collation_key, paradigms = prepared
+    cur.execute(
+        "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (id, entry.lemma, entry.text, seq, hash, definition_html, collation_key)
+    )
+    cur.executemany(
+        "INSERT INTO word_types VALUES (?, ?, ?)",
+        ((id, word_type, lexicon.expand_word_type(word_type)) for word_type in entry.word_types)
+    )
+    for key, values in entry.special.items():
+        cur.executemany(
+            "INSERT INTO specials VALUES (?, ?, ?)",
+            ((id, key, value) for value in values)
+        )
+    cur.executemany(
+        "INSERT OR IGNORE INTO completions VALUES (?, ?, ?, ?, ?)",
+        completion_rows(id, entry, paradigms)
+    )
+    cur.executemany("INSERT INTO forms VALUES (?, ?, ?, ?, ?, ?)", form_rows(id, paradigms))
+    if not entry.text.startswith("SEE"):
+        cur.execute(
+            "INSERT INTO definitions(rowid, definition) VALUES (?, ?)",
+            (id, entry.text)
         )
 
+
+# Renders a definition from Markdown to HTML
+# markdown is only imported when it's first needed (that is, when a
+# database is being generated), so processes that only read the database,
+# such as web workers, never import it
+@functools.cache
+def markdown_converter():
+    import markdown
+    return markdown.Markdown()
+
+def render_definition(text):
+    return markdown_converter().reset().convert(text)
+
+
+# Returns the completions rows of an entry (see LexDB.complete()), given
+# the forms of each of its word types
+def completion_rows(id, entry, paradigms):
+    for word_type, forms in paradigms.items():
+        yield (lexicon.normalize_prefix(entry.lemma), 0, entry.lemma, id, word_type)
+        for value in forms.values():
+            for form in value:
+                if form != '-' and form != entry.lemma:
+                    yield (lexicon.normalize_prefix(form), 1, form, id, word_type)
+
+
+# Returns the forms rows of an entry, given the forms of each of its word
+# types
+def form_rows(id, paradigms):
+    for word_type, forms in paradigms.items():
+        num = 0
+        for name, value in forms.items():
+            for form in value:
+                if form != '-':
+                    yield (id, word_type, num, name, form, lexicon.normalize(form))
+                    num += 1
+
+
+# Inserts the index rows for one index word (see lexicon.index_words())
+def insert_index(cur, index_mode, word, ids):
+    if index_mode == 'fold':
+        key = lexicon.fold(lexicon.normalize(word))
+        cur.executemany(
+            "INSERT INTO fold_index VALUES (?, ?, ?)",
+            ((key, word, id) for id in ids)
+        )
+    else:
+        cur.executemany(
+            "INSERT INTO lex_index VALUES (?, ?)",
+            ((word, id) for id in ids)
+        )
+
+
+# Brings the vocabulary and fuzzy tables up to date with the index, only
+# touching the rows of words that were added or removed
+def update_fuzzy_index(cur, index_mode):
+    cur.execute("CREATE TEMP TABLE index_words (word TEXT PRIMARY KEY) WITHOUT ROWID")
+    if index_mode == 'fold':
+        # Index words are the variants of the forms in fold_index
+        words = set()
+        for (form,) in cur.execute("SELECT DISTINCT form FROM fold_index").fetchall():
+            words.update(lexicon.variant_keys(form))
+        cur.executemany("INSERT INTO index_words VALUES (?)", ((word,) for word in words))
+    else:
+        cur.execute("INSERT INTO index_words SELECT DISTINCT word FROM lex_index")
+    stale_deletions = FUZZY_DELETIONS_SQL.format(words='stale_words')
+    new_deletions = FUZZY_DELETIONS_SQL.format(words='new_words')
+    for statement in (
+        "CREATE TEMP TABLE stale_words AS"
+        " SELECT word FROM vocabulary WHERE word NOT IN index_words",
+        "CREATE TEMP TABLE new_words AS"
+        " SELECT word FROM index_words WHERE word NOT IN vocabulary",
+        f"DELETE FROM fuzzy WHERE (deletion, word) IN ({stale_deletions})",
+        "DELETE FROM vocabulary WHERE word IN stale_words",
+        "INSERT INTO vocabulary SELECT word FROM new_words ORDER BY word",
+        f"INSERT OR IGNORE INTO fuzzy {new_deletions} ORDER BY 1, 2",
+        "DROP TABLE index_words",
+        "DROP TABLE stale_words",
+        "DROP TABLE new_words",
+    ):
+        cur.execute(statement)
+
+
+# Renumbers random_entries and random_counts from scratch (see SCHEMA)
+def update_random_entries(cur):
+    cur.execute("DELETE FROM random_entries")
+    cur.execute("DELETE FROM random_counts")
+    ids = {'': []}
+    rows = cur.execute(
+        "SELECT entries.id, word_type FROM entries LEFT JOIN word_types USING (id)"
+        " WHERE definition NOT GLOB 'SEE *' ORDER BY seq, word_type"
+    ).fetchall()
+    for id, word_type in rows:
+        if not ids[''] or ids[''][-1] != id:
+            ids[''].append(id)
+        if word_type is not None:
+            id_list = ids.setdefault(lexicon.part_of_speech(word_type), [])
+            if not id_list or id_list[-1] != id:
+                id_list.append(id)
+    for part_of_speech, id_list in ids.items():
+        cur.executemany(
+            "INSERT INTO random_entries VALUES (?, ?, ?)",
+            ((part_of_speech, num, id) for num, id in enumerate(id_list))
+        )
+        cur.execute("INSERT INTO random_counts VALUES (?, ?)", (part_of_speech, len(id_list)))
+
+
+# A cursor for LexDB.browse() that starts right after the entry with the
+# given seq and lemma. It's made from the lemma rather than the collation
+# key so it can be read (and typed), and from the seq since entries can
+# have the same lemma. A cursor still works after the database has been
+# rebuilt: it carries on from the same place in the alphabet.
+def browse_cursor(seq, lemma):
+    return f"{seq}:{lemma}"
+
+
+# Returns the (collation key, seq) a cursor starts after, raising ValueError
+# if it isn't a cursor
+def parse_browse_cursor(cursor):
+    seq, sep, lemma = cursor.partition(":")
+    if not sep:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return lexicon.collation_key(lemma), int(seq)
+
+
+# A cursor for LexDB.iter_reverse_lookup() that gets the results after the
+# one with the given rank and seq. Ranks depend on every definition in the
+# database, so after the database has been rebuilt a cursor may skip or
+# repeat a few results.
+def reverse_cursor(rank, seq):
+    return f"{rank!r}:{seq}"
+
+
+# Returns the (rank, seq) a reverse lookup cursor gets the results after,
+# raising ValueError if it isn't a cursor. Ranks are always finite, and
+# SQLite would compare NaN as NULL, so "nan" and "inf" aren't ranks.
+def parse_reverse_cursor(cursor):
+    rank, sep, seq = cursor.rpartition(":")
+    if not sep or not math.isfinite(float(rank)):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return float(rank), int(seq)
+
+
+# Logs the exception being handled, with message % args
+def log_exception(message, *args):
+    # logging is only imported when it's needed, since it's slow to import
+    # (it imports traceback and more) and looking words up doesn't need it
+    import logging
+    logging.getLogger(__name__).exception(message, *args)
+
+
+# Splits a list into lists of at most BATCH_SIZE items
+def batches(items):
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start+BATCH_SIZE]
+
+
+# Returns the first string after all of the strings beginning with prefix
+def prefix_successor(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# Returns the set of spellings made by deleting up to distance letters
+# from word, including word itself
+def deletions(word, distance):
+    results = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {x[:i] + x[i+1:] for x in frontier for i in range(len(x))}
+        results |= frontier
+    return results
+
+
+# Returns the number of insertions, deletions, substitutions and swaps of
+# adjacent letters it takes to turn one word into the other
+def edit_distance(word1, word2):
+    prev2 = None
+    prev = list(range(len(word2) + 1))
+    for i, ch1 in enumerate(word1, 1):
+        row = [i]
+        for j, ch2 in enumerate(word2, 1):
+            cost = 0 if ch1 == ch2 else 1
+            distance = min(prev[j] + 1, row[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and ch1 == word2[j - 2] and word1[i - 2] == ch2:
+                distance = min(distance, prev2[j - 2] + 1)
+            row.append(distance)
+        prev2, prev = prev, row
+    return prev[-1]
+
+
+# Gives the database a new build id and build time (see SCHEMA)
+def stamp_build(cur):
+    cur.executemany(
+        "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+        (('build_id', random_id()), ('build_time', str(int(time.time()))))
+    )
+
+
+# Returns a new random identifier (for build ids and the like)
+# uuid (and tempfile in gen_db()) are only imported when they're needed,
+# since they're slow to import and looking words up doesn't need them
+def random_id():
+    import uuid
+    return uuid.uuid4().hex
+
+
+# Deletes every row belonging to the entries with the given ids
+def delete_entries(cur, ids):
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = ids[start:start+BATCH_SIZE]
+        params = ", ".join("?" * len(batch))
+        # The full-text index has to be told the old text of what it's
+        # deleting, so do this before deleting from entries
+        cur.execute(
+            "INSERT INTO definitions(definitions, rowid, definition)"
+            f" SELECT 'delete', id, definition FROM entries WHERE id IN ({params})"
+            " AND definition NOT GLOB 'SEE*'",
+            batch
+        )
+        for table, column in (
+            ('lex_index', 'entry_id'),
+            ('fold_index', 'entry_id'),
+            ('completions', 'entry_id'),
+            ('forms', 'entry_id'),
+            ('word_types', 'id'),
+            ('specials', 'id'),
+            ('entries', 'id'),
+        ):
+            cur.execute(f"DELETE FROM {table} WHERE {column} IN ({params})", batch)
+
+
+# Converts a search string into an FTS5 query
+# Input: 'to "give birth" bear*'
+# Output: '"to" "give birth" "bear"*'
+# Every term is quoted so that punctuation and words such as AND or NEAR in
+# the search string can't be taken as FTS5 syntax.
+def fts_query(search_string):
+    terms = []
+    for match in SEARCH_TERM_RE.finditer(search_string):
+        phrase, term = match.groups()
+        text = phrase if phrase is not None else term
+        words = re.findall(r"\w+", text)
+        if not words:
+            continue
+        query = '"' + " ".join(words) + '"'
+        if term is not None and term.endswith("*"):
+            query += "*"
+        terms.append(query)
+    return " ".join(terms)
+
+
+# lex_filename may also be an open file (e.g. sys.stdin), in which case the
+# database is always considered out of date
+def is_outdated(lex_filename, db_filename):
+    if not isinstance(lex_filename, (str, bytes, os.PathLike)):
+        return True
+    lex_time = os.stat(lex_filename).st_mtime
+    try:
+        db_time = os.stat(db_filename).st_mtime
+    except FileNotFoundError:
+        return True
+    return lex_time > db_time or read_schema_version(db_filename) != SCHEMA_VERSION
+
+
+# Returns the index mode of an existing database, or None if there isn't
+# an up-to-date one
+def read_index_mode(db_filename):
+    return read_meta(db_filename).get('index_mode')
+
+
+# Returns the contents of the meta table of an existing database as a dict,
+# or an empty dict if there isn't an up-to-date one
+def read_meta(db_filename):
+    if not os.path.exists(db_filename) or read_schema_version(db_filename) != SCHEMA_VERSION:
+        return {}
+    conn = sqlite3.connect(f'file:{db_filename}?mode=ro', uri=True)
+    try:
+        return dict(conn.execute("SELECT key, value FROM meta"))
+    finally:
+        conn.close()
+
+
+# Reads the schema version straight from the database header (it's the
+# user_version field at offset 60) so we don't need to open a connection
+def read_schema_version(db_filename):
+    with open(db_filename, 'rb') as infile:
+        header = infile.read(64)
+    if len(header) < 64:
+        return None
+    return int.from_bytes(header[60:64], 'big')
+
+
+# What a LexDB has done while its stats attribute was set to this object,
+# e.g. during a single web request: the seconds spent in each phase (see
+# timed(); phases can overlap, since suggest() finds and fetches entries
+# too), how many SQL statements were run and rows read, the most levels of
+# redirects followed by a lookup, and how many results were returned
+class Stats(object):
+    def __init__(self):
+        self.timings = {}
+        self.statements = 0
+        self.rows = 0
+        self.redirect_depth = 0
+        self.results = 0
+
+    def add_time(self, phase, seconds):
+        self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+    # Adds the time taken by the with block to the named phase
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+
+# A copy of a database file in memory, which any number of connections in
+# any thread can open by connecting to uri. It's a shared-cache in-memory
+# database, so connections only take shared locks on it when reading and
+# don't get in each other's way.
+# The copy is freed when the MemoryImage and every connection to it have
+# been closed.
+class MemoryImage(object):
+    def __init__(self, db_filename):
+        self.conn = None
+        self.uri = f'file:oedict-{random_id()}?mode=memory&cache=shared'
+        self.conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        source = sqlite3.connect(f'file:{db_filename}?mode=ro', uri=True)
+        try:
+            source.backup(self.conn)
+        finally:
+            source.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# A pool of read-only LexDB connections for long-running processes such as
+# the web app. Each thread gets its own connection (sqlite3 connections
+# can't be shared between threads by default), which is created the first
+# time the thread asks for one and reused after that.
+#
+# Whether the database is out of date is checked every check_interval
+# seconds by a background thread (see watch()), so asking for a connection
+# never touches the lexicon file or waits for the database to be
+# regenerated. Once a new database is ready, the pool switches over to it
+# all at once (see load()), and each thread reopens its connection the next
+# time it asks for it. A check_interval of 0 or None turns the checks off.
+#
+# The lexicon isn't regenerated from until it's been left alone for
+# settle_time seconds, so that a file that's still being written (or is
+# being saved over and over while it's edited) only gets regenerated from
+# once.
+#
+# Connections are only weakly referenced by the pool, so a thread's
+# connection gets closed when the thread exits.
+#
+# build is the (build id, build time) of the current database (see
+# SCHEMA). It's only read when the database changes, so build_info() can
+# be used without touching the database at all.
+#
+# If in_memory is True, the database is copied into memory once (and again
+# whenever it's regenerated), and every thread's connection reads that copy
+# (see MemoryImage). Likewise, if compiled is True, the compiled lexicon is
+# loaded once (see lexbin) and every thread's connection looks words up in
+# it. in_memory, mmap_size and cache_size are passed on to LexDB.
+class LexDBPool(object):
+    def __init__(self, lex_filename, db_filename, check_interval=60,
+                 in_memory=False, mmap_size=None, cache_size=None,
+                 compiled=False, settle_time=SETTLE_TIME, **build_options):
+        # The watcher keeps using these, so they mustn't change meaning if
+        # the process changes directory
+        if isinstance(lex_filename, (str, bytes, os.PathLike)):
+            lex_filename = os.path.abspath(lex_filename)
+        db_filename = os.path.abspath(db_filename)
+        self.lex_filename = lex_filename
+        self.db_filename = db_filename
+        self.check_interval = check_interval
+        self.settle_time = settle_time
+        self.in_memory = in_memory
+        self.compiled = compiled
+        self.connect_options = {'mmap_size': mmap_size, 'cache_size': cache_size}
+        self.build_options = build_options
+        self.image = None
+        self.compiled_lexicon = None
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.check_lock = threading.Lock()
+        self.local = threading.local()
+        self.dbs = weakref.WeakSet()
+        self.closed = False
+        self.stopping = threading.Event()
+        self.watcher = None
+        # The modification time of the lexicon when it last failed to load
+        # (see watch())
+        self.failed_mtime = None
+        LexDB.gen_db_if_outdated(lex_filename, db_filename, **build_options)
+        self.load()
+        self.start_watcher()
+        forked_pools.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.stopping.set()
+        forked_pools.discard(self)
+        with self.lock:
+            self.closed = True
+            for db in list(self.dbs):
+                db.close()
+            self.dbs.clear()
+            self.image = None
+            self.compiled_lexicon = None
+
+    def start_watcher(self):
+        if not self.check_interval or not isinstance(self.lex_filename, (str, bytes, os.PathLike)):
+            return
+        self.watcher = threading.Thread(target=self.watch, name="LexDBPool watcher", daemon=True)
+        self.watcher.start()
+
+    # Threads don't survive fork(), so a child process (such as a web server
+    # worker forked after the app was loaded) needs a watcher of its own.
+    # The parent's connections are left alone (the parent may still be
+    # using them, and SQLite connections mustn't be used on both sides of a
+    # fork), and the child opens its own.
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.check_lock = threading.Lock()
+        self.local = threading.local()
+        self.dbs = weakref.WeakSet()
+        self.watcher = None
+        if not self.stopping.is_set():
+            self.start_watcher()
+
+    # Runs on the watcher thread until the pool is closed
+    # If the database can't be regenerated, the pool carries on with the
+    # database it has. A lexicon with a mistake in it isn't tried again
+    # until it's been changed (hopefully fixed).
+    def watch(self):
+        delay = self.check_interval
+        while not self.stopping.wait(delay):
+            delay = self.check_interval
+            mtime = None
+            try:
+                mtime = os.stat(self.lex_filename).st_mtime
+                age = time.time() - mtime
+                if 0 <= age < self.settle_time:
+                    # Look again once it's settled
+                    delay = min(delay, self.settle_time - age)
+                elif mtime != self.failed_mtime:
+                    self.check()
+                    self.failed_mtime = None
+            except lexicon.LexiconError as err:
+                self.failed_mtime = mtime
+                log_exception("Couldn't update %s: line %s of %s has a mistake in it",
+                              self.db_filename, err.line_num, self.lex_filename)
+            except Exception:
+                log_exception("Couldn't update %s from %s", self.db_filename, self.lex_filename)
+
+    # Regenerates the database if it's out of date, and switches the pool
+    # over to the new one. Returns True if it was regenerated.
+    def check(self):
+        with self.check_lock:
+            if self.stopping.is_set():
+                return False
+            if not LexDB.gen_db_if_outdated(self.lex_filename, self.db_filename, **self.build_options):
+                return False
+            self.load()
+            return True
+
+    # Reads what the pool needs to know about a new database (and copies it
+    # into memory, or loads its compiled lexicon, if need be), and then
+    # switches over to it. Everything is got ready first, so connections
+    # are opened with either everything from the old database or
+    # everything from the new one.
+    def load(self):
+        compiled_lexicon = None
+        image = None
+        with LexDB(self.lex_filename, self.db_filename, check_outdated=False) as db:
+            if self.compiled:
+                compiled_lexicon = lexbin.load(db)
+            build = db.build_id, db.build_time
+        if self.in_memory:
+            image = MemoryImage(self.db_filename)
+        with self.lock:
+            if self.closed:
+                return
+            self.compiled_lexicon = compiled_lexicon
+            self.image = image
+            self.build = build
+            self.generation += 1
+
+    def build_info(self):
+        return self.build
+
+    def get(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None and self.local.generation != self.generation:
+            self.release(db)
+            db = None
+        if db is None:
+            with self.lock:
+                generation = self.generation
+                db = self.new_connection()
+                self.dbs.add(db)
+            self.local.db = db
+            self.local.generation = generation
+        return db
+
+    # Returns a connection of its own to the current database, which unlike
+    # get()'s isn't tied to the thread or kept by the pool, for work that
+    # moves from thread to thread (such as a response streamed a chunk at a
+    # time by separate tasks). The caller closes it.
+    def connect(self):
+        with self.lock:
+            return self.new_connection()
+
+    # The lock must be held
+    def new_connection(self):
+        if self.closed:
+            raise ValueError("LexDBPool is closed")
+        return LexDB(
+            self.lex_filename,
+            self.db_filename,
+            check_outdated=False,
+            image=self.image,
+            compiled_lexicon=self.compiled_lexicon,
+            **self.connect_options
+        )
+
+    def release(self, db):
+        with self.lock:
+            self.dbs.discard(db)
+        db.close()
+        self.local.db = None
+
+    # Context manager so this can be used as a drop-in replacement for
+    # "with LexDB(...) as db"; the connection stays open afterwards
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.get()
+
+
+# The pools that are open, for after_fork_in_child(). There's only the one
+# fork handler however many pools are made and closed, since handlers
+# can't be unregistered.
+forked_pools = weakref.WeakSet()
+
+def after_fork_in_child():
+    for pool in list(forked_pools):
+        pool.after_fork()
+
+os.register_at_fork(after_in_child=after_fork_in_child)
@@ -1,8 +1,15 @@
-import dataclasses
+import array
+import functools
+import itertools
+import os
 import re
 import sys
+import types
 import unicodedata
-import unidecode
+
+# concurrent.futures, hashlib, json and unidecode are only imported when
+# they're needed, since looking words up in an existing database needs very
+# little of this module and the command line tool should start quickly
 
 
 SPECIAL_TYPES = set((
@@ -18,94 +25,303 @@ SPECIAL_TYPES = set((
 ))
 
 
-# NB: num_lines is only a crude hack to aid tracking the line number when parsing the file
-# TODO: list and dict (and therefore 'word_types' and 'special') are mutable
-@dataclasses.dataclass(frozen=True)
+# An entry is immutable: word_types (and word_type_labels) are stored as
+# tuples, and special as a read-only mapping of tuples. There are a lot of
+# entries and they share a small set of word types and special keys, so
+# those strings are interned.
+# first_line and last_line give the span of lines in the lexicon file that
+# the entry came from (they're 0 if it didn't come from a lexicon file)
+# definition_html and word_type_labels are the text rendered to HTML and
+# the expanded word types (see expand_word_type()), if the entry came from
+# a database; they're None otherwise
+# Entries are equal if their lemma, word types, specials and text are; the
+# hash of those is worked out once, when the entry is made.
 class Entry(object):
-    lemma: str
-    word_types: list
-    special: dict
-    text: str
-    num_lines: int
+    __slots__ = (
+        'lemma', 'word_types', 'special', 'text', 'first_line', 'last_line',
+        'definition_html', 'word_type_labels', '_hash',
+    )
+
+    def __init__(self, lemma, word_types, special, text, first_line=0, last_line=0,
+                 definition_html=None, word_type_labels=None):
+        # (Entries from a database have a single string for each special)
+        special = {
+            sys.intern(key): value if isinstance(value, str) else tuple(value)
+            for key, value in special.items()
+        }
+        init = functools.partial(object.__setattr__, self)
+        init('lemma', lemma)
+        init('word_types', tuple(sys.intern(word_type) for word_type in word_types))
+        init('special', types.MappingProxyType(special))
+        init('text', text)
+        init('first_line', first_line)
+        init('last_line', last_line)
+        init('definition_html', definition_html)
+        init('word_type_labels', None if word_type_labels is None else tuple(word_type_labels))
+        init('_hash', hash((lemma, self.word_types, frozenset(special.items()), text)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"can't set attribute '{name}' of Entry")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"can't delete attribute '{name}' of Entry")
 
-    # TODO: ignores self.num_lines; good idea?
     def __eq__(self, other):
-        return (self.lemma == other.lemma
+        if not isinstance(other, Entry):
+            return NotImplemented
+        return (self._hash == other._hash
+            and self.lemma == other.lemma
             and self.word_types == other.word_types
             and self.special == other.special
             and self.text == other.text)
 
     def __hash__(self):
-        # TODO: doesn't hash everything
-        return hash((self.lemma, self.text))
+        return self._hash
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:-1])
+        return f"Entry({fields})"
 
+    # For sending entries to other processes (see index_entries())
+    def __reduce__(self):
+        return (Entry, (
+            self.lemma, self.word_types, dict(self.special), self.text, self.first_line,
+            self.last_line, self.definition_html, self.word_type_labels
+        ))
 
+
+# line_num is the number of the line where the error was found, if known
 class LexiconError(Exception):
-    pass
+    line_num = None
+
 
+# Ways of indexing the lexicon:
+#   'variants': every spelling variant of every form (see gen_variants())
+#       is indexed under its normalized spelling
+#   'fold': every form is indexed once, and words are looked up by their
+#       folded spelling (see fold()) instead
+INDEX_MODES = ('variants', 'fold')
 
+
+# source can be a filename or an open file (or any other iterable of lines),
+# such as sys.stdin. The lexicon is read in a single pass either way.
+# If gen_index is False, only the entries are read, and the index is left
+# empty. Use index_words() to index individual entries.
+# The index (see Index) maps each word to the positions in self.entries of
+# the entries indexed under it.
+# jobs is the number of processes to use to generate the index (see
+# index_entries()).
+# index_mode is one of INDEX_MODES. In 'fold' mode, the keys of the index
+# are forms rather than normalized variants.
 class Lexicon(object):
-    def __init__(self, filename):
+    def __init__(self, source, gen_index=True, jobs=1, index_mode='variants'):
+        if index_mode not in INDEX_MODES:
+            raise ValueError(f"Invalid index mode: {index_mode}")
         self.entries = []
-        self.index = {}
-        entry = None
-        line_num = 1
-        with open(filename, 'r', encoding='utf-8') as infile:
-            try:
-                while entry := read_next_entry(infile):
-                    line_num += entry.num_lines
-                    self.entries.append(entry)
-                    for word_type in entry.word_types:
-                        forms = gen_forms(entry.lemma, word_type, entry.special)
-                        for key, value in forms.items():
-                            assert isinstance(value, list)
-                            for form in value:
-                                if form != '-':
-                                    for variant in gen_variants(form):
-                                        variant = normalize(variant)
-                                        if variant not in self.index:
-                                            self.index[variant] = set()
-                                        self.index[variant].add(entry)
-            except LexiconError as err:
-                # TODO: do something else here??
-                print("Line", line_num, ":", err, file=sys.stderr)
-                sys.exit(1)
-
-
-def read_next_entry(infile):
-    num_lines = 0
-    # Skip comments and blank lines
-    while True:
-        line = infile.readline()
-        if not line:
-            # Hit end of file without finding an entry
-            return None
-        num_lines += 1
-        line = line.strip()
-        if len(line) != 0 and not line.startswith("#"):
-            break
-    if ':' not in line:
+        self.index = Index()
+        self.index_mode = index_mode
+        if isinstance(source, (str, bytes, os.PathLike)):
+            with open(source, 'r', encoding='utf-8') as infile:
+                self.read(infile, gen_index, jobs)
+        else:
+            self.read(source, gen_index, jobs)
+
+    # Raises LexiconError if the lexicon has a mistake in it
+    def read(self, lines, gen_index, jobs):
+        self.entries = list(iter_entries(lines))
+        if gen_index:
+            self.index = Index(index_entries(self.entries, jobs, self.index_mode))
+
+
+# Maps each index word to an array of the positions of the entries indexed
+# under it, in order, given the index words of each entry (as returned by
+# index_entries()). Nearly every word only belongs to one entry, so rather
+# than an array (or set) for each word, the positions of all the words are
+# stored end to end in one array, and each word just has a row number.
+class Index(object):
+    def __init__(self, all_words=()):
+        self.rows = {}
+        counts = array.array('I')
+        for words in all_words:
+            for word in words:
+                row = self.rows.setdefault(word, len(counts))
+                if row == len(counts):
+                    counts.append(0)
+                counts[row] += 1
+        # Row i's positions are postings[offsets[i]:offsets[i + 1]]
+        self.offsets = array.array('I', [0])
+        for count in counts:
+            self.offsets.append(self.offsets[-1] + count)
+        self.postings = array.array('I', bytes(4 * self.offsets[-1]))
+        ends = self.offsets[:-1]
+        for num, words in enumerate(all_words):
+            for word in words:
+                row = self.rows[word]
+                self.postings[ends[row]] = num
+                ends[row] += 1
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, word):
+        return word in self.rows
+
+    def __getitem__(self, word):
+        row = self.rows[word]
+        return self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def items(self):
+        for word, row in self.rows.items():
+            yield word, self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+
+# Returns a list of the index words of each entry (see index_words())
+# If jobs is more than 1, the work is split into chunks and farmed out to
+# that many processes. None or 0 means one process per CPU. The result is
+# the same either way.
+# If prepare is given, it's called with each entry and its paradigms (see
+# entry_paradigms()) in the process that indexes the entry, and the result
+# is a list of (index words, what prepare returned) pairs instead. This is
+# how LexDB renders the rows of the entries in parallel too. prepare has to
+# be a module-level function so that it can be sent to other processes.
+def index_entries(entries, jobs=1, index_mode='variants', prepare=None):
+    if jobs == 1 or len(entries) < 2:
+        return index_chunk(entries, index_mode, prepare)
+    jobs = jobs or os.cpu_count() or 1
+    # Several chunks per process so that one slow chunk doesn't hold up
+    # the others for too long
+    chunk_size = max(1, len(entries) // (jobs * 4))
+    chunks = [entries[i:i+chunk_size] for i in range(0, len(entries), chunk_size)]
+    import concurrent.futures
+    import multiprocessing
+    # The workers are started fresh rather than forked, since this can run
+    # on a LexDBPool's watcher thread, and a forked worker would inherit the
+    # pool and start a watcher of its own (and forking a process with
+    # threads is asking for trouble anyway)
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context) as executor:
+        results = executor.map(index_chunk, chunks, itertools.repeat(index_mode), itertools.repeat(prepare))
+        return [words for result in results for words in result]
+
+
+def index_chunk(entries, index_mode='variants', prepare=None):
+    result = []
+    for entry in entries:
+        try:
+            if prepare is None:
+                result.append(index_words(entry, index_mode))
+            else:
+                paradigms = entry_paradigms(entry)
+                result.append((index_words(entry, index_mode, paradigms), prepare(entry, paradigms)))
+        except LexiconError as err:
+            if err.line_num is None:
+                err.line_num = entry.first_line
+            raise
+    return result
+
+
+# Returns the words under which an entry should be indexed, in sorted order
+# In 'variants' mode, these are the normalized spellings of all variants of
+# all its forms; in 'fold' mode, they're just the forms.
+# paradigms saves generating the forms again if they already have been
+# (see entry_paradigms()).
+def index_words(entry, index_mode='variants', paradigms=None):
+    words = set()
+    for form in entry_forms(entry, paradigms):
+        if index_mode == 'fold':
+            words.add(form)
+        else:
+            for variant in gen_variants(form):
+                words.add(normalize_uncached(variant))
+    return sorted(words)
+
+
+def entry_forms(entry, paradigms=None):
+    if paradigms is None:
+        paradigms = entry_paradigms(entry)
+    for forms in paradigms.values():
+        for key, value in forms.items():
+            assert isinstance(value, list)
+            for form in value:
+                if form != '-':
+                    yield form
+
+
+# Returns the forms of each of an entry's word types (see gen_forms())
+def entry_paradigms(entry):
+    return {
+        word_type: gen_forms(entry.lemma, word_type, entry.special)
+        for word_type in entry.word_types
+    }
+
+
+# Returns a hash of everything that goes into an entry's index words and
+# database rows. This includes the source of this module, since a change to
+# the code that generates forms changes the index just as much as a change
+# to the entry itself.
+def content_hash(entry):
+    import hashlib
+    import json
+    data = json.dumps(
+        [entry.lemma, entry.word_types, dict(entry.special), entry.text],
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha1((source_hash() + data).encode('utf-8')).hexdigest()
+
+@functools.cache
+def source_hash():
+    import hashlib
+    with open(__file__, 'rb') as infile:
+        return hashlib.sha1(infile.read()).hexdigest()
+
+
+# Yields the entries in an iterable of lines (such as an open file), reading
+# each line exactly once
+# An entry is a line of the form "lemma, word types: specials" followed by
+# any number of indented lines of definition text. Blank lines and lines
+# starting with # are skipped.
+def iter_entries(lines):
+    header = None
+    text = ""
+    first_line = last_line = 0
+    try:
+        for line_num, line in enumerate(lines, 1):
+            if header is not None and line.startswith(" "):
+                text += line.strip() + "\n"
+                last_line = line_num
+                continue
+            if header is not None:
+                yield make_entry(header, text, first_line, last_line)
+                header = None
+            line = line.strip()
+            if len(line) != 0 and not line.startswith("#"):
+                header = line
+                text = ""
+                first_line = last_line = line_num
+        if header is not None:
+            yield make_entry(header, text, first_line, last_line)
+    except LexiconError as err:
+        # Any error must have come from the header of the current entry
+        if err.line_num is None:
+            err.line_num = first_line
+        raise
+
+
+def make_entry(header, text, first_line, last_line):
+    if ':' not in header:
         raise LexiconError("missing colon")
-    split_line = line.split(':')
+    split_line = header.split(':')
     if len(split_line) > 2:
         raise LexiconError("too many colons")
     lemma_section = [x.strip() for x in split_line[0].split(",")]
     lemma = lemma_section[0]
     word_types = lemma_section[1:]
     special = parse_special(split_line[1])
-    text = ""
-    backup = infile.tell()
-    while line := infile.readline():
-        if line.startswith(" "):
-            num_lines += 1
-            text += line.strip() + "\n"
-            backup = infile.tell()
-        else:
-            # Whoops, this line isn't part of this entry
-            # We've finished reading the entry
-            infile.seek(backup)
-            break
-    return Entry(lemma, word_types, special, text, num_lines)
+    return Entry(lemma, word_types, special, text, first_line, last_line)
 
 
 # Parses a list of special forms
@@ -125,7 +341,7 @@ def parse_special(special):
 
 
 def gen_forms(lemma, word_type, special):
-    if word_type in ('adji', 'nmi', 'nfi', 'nni', 'adv', 'prep', 'conj', 'int', 'particle'):
+    if word_type in INVARIABLE_TYPES:
         return {'invariable': [lemma]}
     elif word_type[0] == 'n':
         return gen_noun(lemma, word_type, special)
@@ -139,6 +355,105 @@ def gen_forms(lemma, word_type, special):
         raise LexiconError(f"Invalid word type: {word_type}")
 
 
+INVARIABLE_TYPES = frozenset((
+    'adji', 'nmi', 'nfi', 'nni', 'adv', 'prep', 'conj', 'int', 'particle'
+))
+
+
+# Paradigms are described by ending tables, which map each form name to a
+# rule (or a list of rules, whose results are concatenated) of the form:
+#   (stem, test, endings, vowel_endings)
+# stem names the stem that the endings are added to. If test is None, the
+# endings are always used; otherwise, vowel_endings are used instead if the
+# stem named by test ends in a vowel.
+# See inflect().
+LEMMA = ('lemma', None, [""], None)
+
+STRONG_NOUN_ENDINGS = {
+    'm': {
+        'nom.sg': LEMMA,
+        'acc.sg': LEMMA,
+        'gen.sg': ('stem', 'stem', ['es'], ['s']),
+        'dat.sg': ('stem', 'stem', ['e'], [""]),
+        'nom.pl': ('stem_pl', 'stem', ['as'], ['s']),
+        'acc.pl': ('stem_pl', 'stem_pl', ['as'], ['s']),
+        'gen.pl': ('stem_pl', 'stem_pl', ['a'], ['na']),
+        'dat.pl': ('stem_pl', 'stem_pl', ['um'], ['m']),
+    },
+    'f': {
+        'nom.sg': LEMMA,
+        'acc.sg': ('stem', 'stem', ['e'], [""]),
+        'gen.sg': ('stem', 'stem', ['e'], [""]),
+        'dat.sg': ('stem', 'stem', ['e'], [""]),
+        'nom.pl': ('stem_pl', 'stem_pl', ['a', 'e'], [""]),
+        'acc.pl': ('stem_pl', 'stem_pl', ['a', 'e'], [""]),
+        'gen.pl': ('stem_pl', 'stem_pl', ['a'], ['na']),
+        'dat.pl': ('stem_pl', 'stem_pl', ['um'], ['m']),
+    },
+    'n': {
+        'nom.sg': LEMMA,
+        'acc.sg': LEMMA,
+        'gen.sg': ('stem', 'stem', ['es'], ['s']),
+        'dat.sg': ('stem', 'stem', ['e'], [""]),
+        'nom.pl': ('nom_pl', None, [""], None),
+        'acc.pl': ('nom_pl', None, [""], None),
+        'gen.pl': ('stem_pl', 'stem_pl', ['a'], ['na']),
+        'dat.pl': ('stem_pl', 'stem_pl', ['um'], ['m']),
+    },
+    'mv': {
+        'nom.sg': LEMMA,
+        'acc.sg': LEMMA,
+        'gen.sg': ('stem', None, ['es'], None),
+        'dat.sg': ('mutated', None, [""], None),
+        'nom.pl': ('mutated', None, [""], None),
+        'acc.pl': ('mutated', None, [""], None),
+        'gen.pl': ('stem_pl', 'stem_pl', ['a'], ['na']),
+        'dat.pl': ('stem_pl', 'stem_pl', ['um'], ['m']),
+    },
+    'fv': {
+        'nom.sg': LEMMA,
+        'acc.sg': LEMMA,
+        'gen.sg': [('stem', None, ['e'], None), ('mutated', None, [""], None)],
+        'dat.sg': ('mutated', None, [""], None),
+        'nom.pl': ('mutated', None, [""], None),
+        'acc.pl': ('mutated', None, [""], None),
+        'gen.pl': ('stem_pl', 'stem_pl', ['a'], ['na']),
+        'dat.pl': ('stem_pl', 'stem_pl', ['um'], ['m']),
+    },
+}
+
+# Forms that the lexicon can override with the special for another form
+# (e.g. acc.pl is the same as nom.pl if nom.pl is irregular)
+# NB: feminine nouns only use the nom.pl special for acc.pl if the plural
+# stem ends in a consonant (see gen_noun())
+NOUN_OVERRIDES = {
+    'm': {'acc.sg': 'nom.sg', 'acc.pl': 'nom.pl'},
+    'f': {'acc.pl': 'nom.pl'},
+    'n': {'acc.sg': 'nom.sg', 'acc.pl': 'nom.pl'},
+    'mv': {'acc.sg': 'nom.sg', 'acc.pl': 'nom.pl'},
+    'fv': {'acc.sg': 'nom.sg', 'acc.pl': 'nom.pl'},
+}
+
+NOUN_FORMS = frozenset((
+    'nom.sg', 'acc.sg', 'gen.sg', 'dat.sg',
+    'nom.pl', 'acc.pl', 'gen.pl', 'dat.pl',
+))
+
+
+def inflect(endings, stems):
+    forms = {}
+    for name, rules in endings.items():
+        if isinstance(rules, tuple):
+            rules = [rules]
+        forms[name] = []
+        for stem_name, test, suffixes, vowel_suffixes in rules:
+            stem = stems[stem_name]
+            if test is not None and is_vowel(stems[test][-1]):
+                suffixes = vowel_suffixes
+            forms[name] += [stem + suffix for suffix in suffixes]
+    return forms
+
+
 def gen_noun(lemma, word_type, special):
     if 'stem' in special:
         if len(special['stem']) > 1:
@@ -154,73 +469,68 @@ def gen_noun(lemma, word_type, special):
         stem_pl = special['stem.pl'][0]
     else:
         stem_pl = lower_ae(stem)
-    if word_type[1:] == 'm':
-        # Strong masculine noun
-        forms = {
-            'nom.sg': [lemma],
-            'acc.sg': special.get('nom.sg') or [lemma],
-            'gen.sg': [stem + ('es' if not is_vowel(stem[-1]) else 's')],
-            'dat.sg': [stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'nom.pl': [stem_pl + ('as' if not is_vowel(stem[-1]) else 's')],
-            'acc.pl': special.get('nom.pl') or [stem_pl + ('as' if not is_vowel(stem_pl[-1]) else 's')],
-            'gen.pl': [stem_pl + ('a' if not is_vowel(stem_pl[-1]) else 'na')],
-            'dat.pl': [stem_pl + ('um' if not is_vowel(stem_pl[-1]) else 'm')],
-        }
-    elif word_type[1:] == 'f':
-        forms = {
-            'nom.sg': [lemma],
-            'acc.sg': [stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'gen.sg': [stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'dat.sg': [stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'nom.pl': [stem_pl + 'a', stem_pl + 'e'] if not is_vowel(stem_pl[-1]) else [stem_pl],
-            'acc.pl': special.get('nom.pl') or [stem_pl + 'a', stem_pl + 'e'] if not is_vowel(stem_pl[-1]) else [stem_pl],
-            'gen.pl': [stem_pl + ('a' if not is_vowel(stem_pl[-1]) else 'na')],
-            'dat.pl': [stem_pl + ('um' if not is_vowel(stem_pl[-1]) else 'm')],
-        }
-    elif word_type[1:] == 'n':
-        # Strong neuter noun
-        nom_pl = add_u(lemma, stem_pl)
-        forms = {
-            'nom.sg': [lemma],
-            'acc.sg': special.get('nom.sg') or [lemma],
-            'gen.sg': [stem + ('es' if not is_vowel(stem[-1]) else 's')],
-            'dat.sg': [stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'nom.pl': [nom_pl],
-            'acc.pl': special.get('nom.pl') or [nom_pl],
-            'gen.pl': [stem_pl + ('a' if not is_vowel(stem_pl[-1]) else 'na')],
-            'dat.pl': [stem_pl + ('um' if not is_vowel(stem_pl[-1]) else 'm')],
-        }
-    elif word_type[1:] in ('mw', 'fw', 'nw'):
+    declension = word_type[1:]
+    if declension in STRONG_NOUN_ENDINGS:
+        # Strong or vocalic noun
+        stems = {'lemma': lemma, 'stem': stem, 'stem_pl': stem_pl}
+        if declension == 'n':
+            stems['nom_pl'] = add_u(lemma, stem_pl)
+        elif declension in ('mv', 'fv'):
+            stems['mutated'] = i_mutate(lemma)
+        forms = inflect(STRONG_NOUN_ENDINGS[declension], stems)
+        for name, source in NOUN_OVERRIDES[declension].items():
+            if declension == 'f' and is_vowel(stem_pl[-1]):
+                continue
+            forms[name] = list(special.get(source) or forms[name])
+    elif declension in ('mw', 'fw', 'nw'):
         # Weak noun
         forms = gen_weak_nominal(stem, word_type[1])
-    elif word_type[1:] in ('mv', 'fv'):
-        # Vocalic noun
-        mutated = i_mutate(lemma)
-        if word_type[1] == 'm':
-            genitives = [stem + 'es']
-        else:
-            genitives = [stem + 'e', mutated]
-        forms = {
-            'nom.sg': [lemma],
-            'acc.sg': special.get('nom.sg') or [lemma],
-            'gen.sg': genitives,     # no brackets!
-            'dat.sg': [mutated],
-            'nom.pl': [mutated],
-            'acc.pl': special.get('nom.pl') or [mutated],
-            'gen.pl': [stem_pl + ('a' if not is_vowel(stem_pl[-1]) else 'na')],
-            'dat.pl': [stem_pl + ('um' if not is_vowel(stem_pl[-1]) else 'm')],
-        }
     else:
         # Other (TODO: implement all types and throw an error here instead)
         forms = {'nom.sg': [lemma]}
-    special_forms = { key: value for (key, value) in special.items() if key in [
-        'nom.sg', 'acc.sg', 'gen.sg', 'dat.sg',
-        'nom.pl', 'acc.pl', 'gen.pl', 'dat.pl',
-    ] }
+    special_forms = { key: list(value) for (key, value) in special.items() if key in NOUN_FORMS }
     forms.update(special_forms)
     return forms
 
 
+# Stems: 'stem' is the lemma minus any final vowel or h, and 'light' is the
+# stem with æ lowered to a (see lower_ae())
+STRONG_ADJECTIVE_ENDINGS = {
+    'masc.nom.sg': LEMMA,
+    'masc.acc.sg': ('stem', None, ['ne'], None),
+    'masc.gen.sg': ('light', 'stem', ['es'], ['s']),
+    'masc.dat.sg': ('light', None, ['um'], None),
+    'masc.nom.pl': ('light', 'stem', ['e'], [""]),
+    'masc.acc.pl': ('light', 'stem', ['e'], [""]),
+    'masc.gen.pl': ('stem', None, ['ra'], None),
+    'masc.dat.pl': ('light', None, ['um'], None),
+    'fem.nom.sg': ('with_u', None, [""], None),
+    'fem.acc.sg': ('light', 'stem', ['e'], [""]),
+    'fem.gen.sg': ('stem', None, ['re'], None),
+    'fem.dat.sg': ('stem', None, ['re'], None),
+    'fem.nom.pl': ('light', 'light', ['a', 'e'], [""]),
+    'fem.acc.pl': ('light', 'light', ['a', 'e'], [""]),
+    'fem.gen.pl': ('stem', None, ['ra'], None),
+    'fem.dat.pl': ('light', None, ['um'], None),
+    'neut.nom.sg': ('with_u', None, [""], None),
+    'neut.acc.sg': ('with_u', None, [""], None),
+    'neut.gen.sg': ('light', 'stem', ['es'], ['s']),
+    'neut.dat.sg': ('light', None, ['um'], None),
+    'neut.nom.pl': ('light', 'stem', ['e'], [""]),
+    'neut.acc.pl': ('light', 'stem', ['e'], [""]),
+    'neut.gen.pl': ('stem', None, ['ra'], None),
+    'neut.dat.pl': ('light', None, ['um'], None),
+}
+
+ADJECTIVE_FORMS = frozenset(
+    prefix + gender + '.' + case + '.' + number
+    for prefix in ("", 'w.')
+    for gender in ('masc', 'fem', 'neut')
+    for number in ('sg', 'pl')
+    for case in ('nom', 'acc', 'gen', 'dat')
+)
+
+
 def gen_adjective(lemma, word_type, special):
     has_strong = word_type != 'adjw'
     has_weak = word_type != 'adjs'
@@ -228,55 +538,30 @@ def gen_adjective(lemma, word_type, special):
     light_stem = lower_ae(stem)
     forms = {}
     if has_strong:
-        forms.update({
-            'masc.nom.sg': [lemma],
-            'masc.acc.sg': [stem + 'ne'],
-            'masc.gen.sg': [light_stem + ('es' if not is_vowel(stem[-1]) else 's')],
-            'masc.dat.sg': [light_stem + 'um'],
-            'masc.nom.pl': [light_stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'masc.acc.pl': [light_stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'masc.gen.pl': [stem + 'ra'],
-            'masc.dat.pl': [light_stem + 'um'],
-            'fem.nom.sg': [add_u(lemma, light_stem)],
-            'fem.acc.sg': [light_stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'fem.gen.sg': [stem + 're'],
-            'fem.dat.sg': [stem + 're'],
-            'fem.nom.pl': [light_stem + 'a', light_stem + 'e'] if not is_vowel(light_stem[-1]) else [light_stem],
-            'fem.acc.pl': [light_stem + 'a', light_stem + 'e'] if not is_vowel(light_stem[-1]) else [light_stem],
-            'fem.gen.pl': [stem + 'ra'],
-            'fem.dat.pl': [light_stem + 'um'],
-            'neut.nom.sg': [add_u(lemma, light_stem)],
-            'neut.acc.sg': [add_u(lemma, light_stem)],
-            'neut.gen.sg': [light_stem + ('es' if not is_vowel(stem[-1]) else 's')],
-            'neut.dat.sg': [light_stem + 'um'],
-            'neut.nom.pl': [light_stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'neut.acc.pl': [light_stem + ('e' if not is_vowel(stem[-1]) else "")],
-            'neut.gen.pl': [stem + 'ra'],
-            'neut.dat.pl': [light_stem + 'um'],
-        })
+        stems = {
+            'lemma': lemma,
+            'stem': stem,
+            'light': light_stem,
+            'with_u': add_u(lemma, light_stem),
+        }
+        forms.update(inflect(STRONG_ADJECTIVE_ENDINGS, stems))
     if has_weak:
         forms.update(gen_weak_nominal(stem, 'm', True, 'w.masc.'))
         forms.update(gen_weak_nominal(stem, 'f', True, 'w.fem.'))
         forms.update(gen_weak_nominal(stem, 'm', True, 'w.neut.'))
-    special_forms = { key: value for (key, value) in special.items() if key in [
-        'masc.nom.sg', 'masc.acc.sg', 'masc.gen.sg', 'masc.dat.sg',
-        'masc.nom.pl', 'masc.acc.pl', 'masc.gen.pl', 'masc.dat.pl',
-        'fem.nom.sg', 'fem.acc.sg', 'fem.gen.sg', 'fem.dat.sg',
-        'fem.nom.pl', 'fem.acc.pl', 'fem.gen.pl', 'fem.dat.pl',
-        'neut.nom.sg', 'neut.acc.sg', 'neut.gen.sg', 'neut.dat.sg',
-        'neut.nom.pl', 'neut.acc.pl', 'neut.gen.pl', 'neut.dat.pl',
-        'w.masc.nom.sg', 'w.masc.acc.sg', 'w.masc.gen.sg', 'w.masc.dat.sg',
-        'w.masc.nom.pl', 'w.masc.acc.pl', 'w.masc.gen.pl', 'w.masc.dat.pl',
-        'w.fem.nom.sg', 'w.fem.acc.sg', 'w.fem.gen.sg', 'w.fem.dat.sg',
-        'w.fem.nom.pl', 'w.fem.acc.pl', 'w.fem.gen.pl', 'w.fem.dat.pl',
-        'w.neut.nom.sg', 'w.neut.acc.sg', 'w.neut.gen.sg', 'w.neut.dat.sg',
-        'w.neut.nom.pl', 'w.neut.acc.pl', 'w.neut.gen.pl', 'w.neut.dat.pl',
-    ] }
+    special_forms = { key: list(value) for (key, value) in special.items() if key in ADJECTIVE_FORMS }
     forms.update(special_forms)
     return forms
 
 
 def gen_weak_nominal(stem, gender, adjective=False, prefix=""):
+    forms = weak_nominal_forms(stem, gender, adjective)
+    return {prefix + name: list(value) for name, value in forms.items()}
+
+# The forms only depend on the stem, so cache them; lots of adjectives
+# share endings with each other and with weak nouns
+@functools.lru_cache(maxsize=4096)
+def weak_nominal_forms(stem, gender, adjective):
     if is_vowel(stem[-1]):
         nominative = stem
         oblique = stem + 'n'
@@ -297,42 +582,108 @@ def gen_weak_nominal(stem, gender, adjective=False, prefix=""):
     else:
         accusative = oblique
     return {
-        f'{prefix}nom.sg': [nominative],
-        f'{prefix}acc.sg': [accusative],
-        f'{prefix}gen.sg': [oblique],
-        f'{prefix}dat.sg': [oblique],
-        f'{prefix}nom.pl': [oblique],
-        f'{prefix}acc.pl': [oblique],
-        f'{prefix}gen.pl': gen_pls,
-        f'{prefix}dat.pl': dat_pls,
+        'nom.sg': (nominative,),
+        'acc.sg': (accusative,),
+        'gen.sg': (oblique,),
+        'dat.sg': (oblique,),
+        'nom.pl': (oblique,),
+        'acc.pl': (oblique,),
+        'gen.pl': tuple(gen_pls),
+        'dat.pl': tuple(dat_pls),
     }
 
 
+PRONOUN_FORMS = frozenset(('acc', 'dat', 'gen'))
+
+
 def gen_pronoun(lemma, word_type, special):
     # Pronouns in the lexicon file define all their forms explicitly
     forms = {'nom': [lemma]}
-    forms.update({key: value for (key, value) in special.items() if key in [
-        'acc', 'dat', 'gen'
-    ]})
+    forms.update({key: list(value) for (key, value) in special.items() if key in PRONOUN_FORMS})
     return forms
 
 
+# Endings added to the past stem of weak verbs (and of irregular verbs whose
+# past is given by the 'past' special), e.g. hīerd → hīerde, hīerdest...
+WEAK_PAST_ENDINGS = {
+    'past.1sg': 'e',
+    'past.2sg': 'est',
+    'past.pl': 'on',
+    'past.subj.sg': 'e',
+    'past.subj.pl': 'en',
+}
+
+# Endings added to the past plural stem of strong verbs (and of irregular
+# verbs whose past plural is given by the 'past.pl' special),
+# e.g. bitan → biten, bite
+STRONG_PAST_ENDINGS = {
+    'past.2sg': 'e',
+    'past.subj.sg': 'e',
+    'past.subj.pl': 'en',
+}
+
+def strong_class_3_past_1sg(nucleus):
+    if nucleus == 'e':
+        return 'æ'
+    elif nucleus == 'i':
+        return 'a'
+    else:
+        return 'ea'
+
+def strong_class_3_pp(nucleus):
+    return 'u' if nucleus == 'i' else 'o'
+
+def strong_class_7_pp(nucleus):
+    return nucleus
+
+# The vowels that replace the nucleus of the infinitive stem to form the
+# past 1sg, past plural and past participle of each class of strong verb
+# (or a function that takes the nucleus and returns its replacement)
+STRONG_VERB_CLASSES = {
+    '1': ('ā', 'i', 'i'),
+    '2': ('ēa', 'u', 'o'),
+    '3': (strong_class_3_past_1sg, 'u', strong_class_3_pp),
+    '4': ('æ', 'ǣ', 'o'),
+    '5': ('æ', 'ǣ', 'e'),
+    '6': ('ō', 'ō', 'a'),
+    '7': ('ēo', 'ēo', strong_class_7_pp),
+}
+
+# Weak class I verbs whose short stem drops a doubled consonant or -i-,
+# e.g. fremman → 3sg fremeþ
+WEAK_1_SHORT_STEM_ENDINGS = ('ċċan', 'llan', 'mman', 'nnan', 'ppan', 'rian', 'rran', 'ssan')
+
+IRREGULAR_INFINITIVE_ENDINGS = ('ēan', 'ēon', 'īon', 'ān', 'ōn', 'ȳn')
+
+VOWEL_TAN_RE = re.compile(r"[āaǣæēeīiōoūu]tan$", re.IGNORECASE)
+WEAK_PAST_D_RE = re.compile(r"[^eol]d$")
+
+VERB_FORMS = frozenset((
+    'inf', 'long.inf',
+    '1sg', '2sg', '3sg', 'pl',
+    'subj.sg', 'subj.pl',
+    'past.1sg', 'past.2sg', 'past.pl',
+    'past.subj.sg', 'past.subj.pl',
+    'imp', 'imp.pl', 'pres.p', 'pp'
+))
+
+
 def gen_verb(lemma, word_type, special):
     long_infinitives = [lemma + 'ne']
-    if lemma.endswith(('ēan', 'ēon', 'īon', 'ān', 'ōn', 'ȳn')):
+    if lemma.endswith(IRREGULAR_INFINITIVE_ENDINGS):
         # Irregular infinitive
         inf_stem = lemma[:-1]
         pres_1sg = inf_stem
-        subjs = special.get('subj') or [inf_stem]
-        pres_participles = special.get('pres.p') or [lemma + 'de']
+        subjs = list(special.get('subj') or [inf_stem])
+        pres_participles = list(special.get('pres.p') or [lemma + 'de'])
         irregular_infinitive = True
     elif lemma.endswith('an'):
         # Regular infinitive
         inf_stem = lemma[:-2]
         pres_1sg = inf_stem + 'e'
         long_infinitives.append(inf_stem + 'enne')
-        subjs = special.get('subj') or [inf_stem + 'e']
-        pres_participles = special.get('pres.p') or [lemma[:-2] + 'ende']
+        subjs = list(special.get('subj') or [inf_stem + 'e'])
+        pres_participles = list(special.get('pres.p') or [lemma[:-2] + 'ende'])
         irregular_infinitive = False
     else:
         raise LexiconError(f"invalid infinitive: {lemma}")
@@ -357,7 +708,7 @@ def gen_verb(lemma, word_type, special):
             elif lemma.endswith('ċġan'):
                 short_stem = lemma[:-4] + 'ġe'
             else:
-                if lemma.endswith(('ċċan', 'llan', 'mman', 'nnan', 'ppan', 'rian', 'rran', 'ssan')):
+                if lemma.endswith(WEAK_1_SHORT_STEM_ENDINGS):
                     short_stem = lemma[:-3] + 'e'
                 else:
                     short_stem = long_stem
@@ -365,7 +716,7 @@ def gen_verb(lemma, word_type, special):
                 past_stem = lemma[:-5] + 'eaht'
             elif lemma.endswith('ellan'):
                 past_stem = lemma[:-5] + 'eald'
-            elif re.search(r"[āaǣæēeīiōoūu]tan$", lemma, re.IGNORECASE):
+            elif VOWEL_TAN_RE.search(lemma):
                 past_stem = lemma[:-2] + 't'
             elif short_stem.endswith(('t', 'd')):
                 past_stem = short_stem
@@ -383,10 +734,10 @@ def gen_verb(lemma, word_type, special):
             short_stem = ""     # TODO: hacky. Result gets overwritten
         else:
             raise LexiconError("invalid weak verb class")
-        past_stems = special.get('past') or [past_stem]
+        past_stems = list(special.get('past') or [past_stem])
         pps = past_stems
         if len(past_stems) == 1:
-            if re.search(r"[^eol]d$", past_stems[0]):
+            if WEAK_PAST_D_RE.search(past_stems[0]):
                 if inf_stem[-1] == 'd':
                     # Transform e.g. bend into bended
                     pps = [past_stems[0] + 'ed']
@@ -405,63 +756,31 @@ def gen_verb(lemma, word_type, special):
             '2sg': [assimilate(short_stem, 'st')],
             '3sg': [assimilate(short_stem, 'þ')],
             'pl': [inf_stem + 'aþ'],
-            'past.1sg': [x + 'e' for x in past_stems],
-            'past.2sg': [x + 'est' for x in past_stems],
-            'past.pl': [x + 'on' for x in past_stems],
-            'past.subj.sg': [x + 'e' for x in past_stems],
-            'past.subj.pl': [x + 'en' for x in past_stems],
+        })
+        result.update(add_endings(past_stems, WEAK_PAST_ENDINGS))
+        result.update({
             'imp': [short_stem],
             'pp': pps,
         })
     elif word_type[1] == 's':
         # Strong verb
+        if word_type[2] not in STRONG_VERB_CLASSES:
+            raise LexiconError("invalid strong verb class")
+        past_1sg_repl, past_pl_repl, pp_repl = STRONG_VERB_CLASSES[word_type[2]]
         mutated_stem = palatalize_g(i_mutate(inf_stem))
-        if word_type[2] == '1':
-            past_1sg_repl = 'ā'
-            past_pl_repl = 'i'
-            pp_repl = 'i'
-        elif word_type[2] == '2':
-            past_1sg_repl = 'ēa'
-            past_pl_repl = 'u'
-            pp_repl = 'o'
-        elif word_type[2] == '3':
-            def past_1sg_repl(nucleus):
-                if nucleus == 'e':
-                    return 'æ'
-                elif nucleus == 'i':
-                    return 'a'
-                else:
-                    return 'ea'
-            past_pl_repl = 'u'
-            pp_repl = lambda nucleus: 'u' if nucleus == 'i' else 'o'
-        elif word_type[2] == '4':
-            past_1sg_repl = 'æ'
-            past_pl_repl = 'ǣ'
-            pp_repl = 'o'
-        elif word_type[2] == '5':
-            past_1sg_repl = 'æ'
-            past_pl_repl = 'ǣ'
-            pp_repl = 'e'
-        elif word_type[2] == '6':
-            past_1sg_repl = 'ō'
-            past_pl_repl = 'ō'
-            pp_repl = 'a'
-        elif word_type[2] == '7':
-            past_1sg_repl = 'ēo'
-            past_pl_repl = 'ēo'
-            pp_repl = lambda nucleus: nucleus
-        past_pls = special.get('past.pl') or [mutate(inf_stem, past_pl_repl) + 'on']
+        past_pls = list(special.get('past.pl') or [mutate(inf_stem, past_pl_repl) + 'on'])
         past_pl_stems = [x[:-2] for x in past_pls]
         past_participles = [mutate(inf_stem, pp_repl) + 'en']
+        past_forms = add_endings(past_pl_stems, STRONG_PAST_ENDINGS)
         result.update({
             '2sg': [assimilate(mutated_stem, 'st')],
             '3sg': [assimilate(mutated_stem, 'þ')],
             'pl': [inf_stem + 'aþ'],
             'past.1sg': [mutate(inf_stem, past_1sg_repl)],
-            'past.2sg': [x + 'e' for x in past_pl_stems],
+            'past.2sg': past_forms['past.2sg'],
             'past.pl': past_pls,
-            'past.subj.sg': [x + 'e' for x in past_pl_stems],
-            'past.subj.pl': [x + 'en' for x in past_pl_stems],
+            'past.subj.sg': past_forms['past.subj.sg'],
+            'past.subj.pl': past_forms['past.subj.pl'],
             'imp': [inf_stem],
             'pp': past_participles,
         })
@@ -471,33 +790,16 @@ def gen_verb(lemma, word_type, special):
         # Past participle is *not* inferred from "past" special
         if 'past' in special:
             # Past conjugates like weak verb (e.g. ēodon)
-            result.update({
-                'past.1sg': [x + 'e' for x in special['past']],
-                'past.2sg': [x + 'est' for x in special['past']],
-                'past.pl': [x + 'on' for x in special['past']],
-                'past.subj.sg': [x + 'e' for x in special['past']],
-                'past.subj.pl': [x + 'en' for x in special['past']],
-            })
+            result.update(add_endings(special['past'], WEAK_PAST_ENDINGS))
         elif 'past.pl' in special:
             # Past conjugates like strong verb (e.g. wǣron)
             stems = [x[:-2] for x in special['past.pl']]
-            result.update({
-                'past.2sg': [x + 'e' for x in stems],
-                'past.subj.sg': [x + 'e' for x in stems],
-                'past.subj.pl': [x + 'en' for x in stems],
-            })
+            result.update(add_endings(stems, STRONG_PAST_ENDINGS))
         if word_type == 'vpp':
             result['pres.pl'] = [inf_stem + 'on']
     else:
         raise LexiconError(f"Unrecognized verb type: {word_type}")
-    special_forms = { key: value for (key, value) in special.items() if key in [
-        'inf', 'long.inf',
-        '1sg', '2sg', '3sg', 'pl',
-        'subj.sg', 'subj.pl',
-        'past.1sg', 'past.2sg', 'past.pl',
-        'past.subj.sg', 'past.subj.pl',
-        'imp', 'imp.pl', 'pres.p', 'pp'
-    ] }
+    special_forms = { key: list(value) for (key, value) in special.items() if key in VERB_FORMS }
     result.update(special_forms)
     if 'pp' in result and result['pp'] != ['-']:
         result['pp'] = result['pp'] + [
@@ -506,14 +808,26 @@ def gen_verb(lemma, word_type, special):
     return result
 
 
+def add_endings(stems, endings):
+    return {name: [stem + ending for stem in stems] for name, ending in endings.items()}
+
+
+VOWELS = frozenset('AÆEIOUYĀǢĒĪŌŪȲaæeiouyāǣēīōūȳ')
+
 def is_vowel(ch):
     assert len(ch) == 1
-    return ch in 'AÆEIOUYĀǢĒĪŌŪȲaæeiouyāǣēīōūȳ'
+    return ch in VOWELS
+
+
+# The functions below only depend on their arguments, and are called with
+# the same stems over and over, so their results are cached
 
+I_MUTATION = str.maketrans('āæeōoūu', 'ǣeiēeȳy')
 
 # I-mutates the nucleus of the last syllable of its argument
 # TODO: only works when the nucleus and everything after it is lowercase.
 #   Is that OK?
+@functools.lru_cache(maxsize=4096)
 def i_mutate(word):
     initial, nucleus, final = split_word(word)
     if nucleus in ('ēa', 'ēo', 'īo', 'īe'):
@@ -524,11 +838,12 @@ def i_mutate(word):
         # This bit is why we can't just call mutate()
         nucleus = 'e' if final.startswith(('n', 'm')) else 'æ'
     else:
-        nucleus = nucleus.translate(str.maketrans('āæeōoūu', 'ǣeiēeȳy'))
+        nucleus = nucleus.translate(I_MUTATION)
     return initial + nucleus + final
 
 # TODO: only works when the nucleus and everything after it is lowercase.
 #   Is that OK?
+@functools.lru_cache(maxsize=4096)
 def mutate(word, replacement):
     initial, nucleus, final = split_word(word)
     if callable(replacement):
@@ -537,35 +852,50 @@ def mutate(word, replacement):
         nucleus = replacement
     return initial + nucleus + final
 
+SPLIT_WORD_RE = re.compile(
+    r"(.*?)(ēa|ea|ēo|eo|īo|io|īe|ie|[āaǣæēeīiōoūuȳy])([b-df-hj-np-tvwxzþðċġ]*)$",
+    re.IGNORECASE
+)
+
+@functools.lru_cache(maxsize=4096)
 def split_word(word):
-    match = re.match(r"(.*?)(ēa|ea|ēo|eo|īo|io|īe|ie|[āaǣæēeīiōoūuȳy])([b-df-hj-np-tvwxzþðċġ]*)$", word, re.IGNORECASE)
+    match = SPLIT_WORD_RE.match(word)
     return match.groups()
 
 
+HEAVY_NUCLEI = frozenset(('ā', 'ǣ', 'ē', 'ī', 'ō', 'ū', 'ēa', 'ēo', 'īo', 'īe'))
+
 # Add -u to form neuter plurals and feminine singulars
 # according to syllable structure of the lemma
 # The stem argument allows things such as hēafod → hēafdu
 # TODO: support uppercase??
+@functools.lru_cache(maxsize=4096)
 def add_u(lemma, stem):
     if lemma[-1] == 'e':
         # -e always becomes -u
         return stem + 'u'
     _, vowel, end = split_word(lemma)
-    if vowel in ('ā', 'ǣ', 'ē', 'ī', 'ō', 'ū', 'ēa', 'ēo', 'īo', 'īe') or len(end) > 1 or end == 'x':
+    if vowel in HEAVY_NUCLEI or len(end) > 1 or end == 'x':
         # Lemma ends in heavy syllable; no -u
         return lemma
     return stem + 'u'
 
 
+LOWER_AE_RE = re.compile(r"^(.*)æ([b-df-hj-np-tvwzþðċġ])$")
+PALATALIZE_G_RE = re.compile(r"^(.*[^n])g$")
+
 # Lowers æ to a if stem ends with a single consonant (not x)
 # e.g. smæl → smal
+@functools.lru_cache(maxsize=4096)
 def lower_ae(stem):
-    return re.sub(r"^(.*)æ([b-df-hj-np-tvwzþðċġ])$", r"\1a\2", stem, re.IGNORECASE)
+    return LOWER_AE_RE.sub(r"\1a\2", stem)
 
+@functools.lru_cache(maxsize=4096)
 def palatalize_g(stem):
-    return re.sub(r"^(.*[^n])g$", r"\1ġ", stem)
+    return PALATALIZE_G_RE.sub(r"\1ġ", stem)
 
 
+@functools.lru_cache(maxsize=4096)
 def assimilate(stem, suffix):
     # TODO: this condition is a hack we shouldn't need
     if len(stem) == 0:
@@ -604,11 +934,14 @@ def gen_variants(text):
     return results
 
 # TODO: OK to ignore capitalization?
+# NB: the rules are grouped by the first letter of what they match so that
+# most letters only need one comparison
 def gen_variants_impl(next, results, preceding=""):
     if len(next) == 0:
         # Reached end of word
         results.append(preceding)
         return
+    first = next[0]
     if next == 'w' and preceding.endswith('ēo'):
         # This is a word like trēow, which can also be spelled trēo
         results += [preceding, preceding + 'w']
@@ -617,59 +950,123 @@ def gen_variants_impl(next, results, preceding=""):
         # This is a word like burg, dēag, etc.
         results += [preceding, preceding + 'h']
         return
-    if next.startswith('īo'):
-        gen_variants_impl(next[2:], results, preceding + 'ēo')
-    elif next.startswith('io'):
-        gen_variants_impl(next[2:], results, preceding + 'eo')
-        # Anglian smoothing
-        if next.startswith(('ioh', 'iorc', 'iorg', 'iorh')):
+    if first == 'ī':
+        if next.startswith('īo'):
+            gen_variants_impl(next[2:], results, preceding + 'ēo')
+        elif next.startswith('īe'):
+            gen_variants_impl(next[2:], results, preceding + 'ī')
+            gen_variants_impl(next[2:], results, preceding + 'ȳ')
+        else:
+            gen_variants_impl(next[1:], results, preceding + 'ȳ')
+    elif first == 'i':
+        if next.startswith('io'):
+            gen_variants_impl(next[2:], results, preceding + 'eo')
+            # Anglian smoothing
+            if next.startswith(('ioh', 'iorc', 'iorg', 'iorh')):
+                gen_variants_impl(next[2:], results, preceding + 'i')
+        elif next.startswith('ie'):
             gen_variants_impl(next[2:], results, preceding + 'i')
-    elif next.startswith('ēo'):
-        gen_variants_impl(next[2:], results, preceding + 'īo')
-    elif next.startswith('eo'):
-        gen_variants_impl(next[2:], results, preceding + 'io')
-        # Anglian smoothing
-        if next.startswith(('eoh', 'eorc', 'eorg', 'eorh')):
-            gen_variants_impl(next[2:], results, preceding + 'e')
-    elif next.startswith('īe'):
-        gen_variants_impl(next[2:], results, preceding + 'ī')
-        gen_variants_impl(next[2:], results, preceding + 'ȳ')
-    elif next.startswith('ie'):
-        gen_variants_impl(next[2:], results, preceding + 'i')
-        gen_variants_impl(next[2:], results, preceding + 'y')
-    elif next.startswith('ī'):
-        gen_variants_impl(next[1:], results, preceding + 'ȳ')
-    elif next.startswith('i'):
-        gen_variants_impl(next[1:], results, preceding + 'y')
-    elif next.startswith('ȳ'):
+            gen_variants_impl(next[2:], results, preceding + 'y')
+        else:
+            gen_variants_impl(next[1:], results, preceding + 'y')
+    elif first == 'ē':
+        if next.startswith('ēo'):
+            gen_variants_impl(next[2:], results, preceding + 'īo')
+    elif first == 'e':
+        if next.startswith('eo'):
+            gen_variants_impl(next[2:], results, preceding + 'io')
+            # Anglian smoothing
+            if next.startswith(('eoh', 'eorc', 'eorg', 'eorh')):
+                gen_variants_impl(next[2:], results, preceding + 'e')
+    elif first == 'ȳ':
         gen_variants_impl(next[1:], results, preceding + 'ī')
-    elif next.startswith('y'):
+    elif first == 'y':
         gen_variants_impl(next[1:], results, preceding + 'i')
-    elif next.startswith(('an', 'am')) and not preceding.endswith(('ē', 'e')):
-        gen_variants_impl(next[1:], results, preceding + 'o')
-    elif next.startswith(('on', 'om')) and not preceding.endswith(('ē', 'e')):
-        gen_variants_impl(next[1:], results, preceding + 'a')
-    elif next.startswith('cg'):
-        gen_variants_impl(next[2:], results, preceding + 'gg')
-    elif next.startswith('ċġ'):
-        gen_variants_impl(next[2:], results, preceding + 'ġġ')
-    elif next.startswith('sel'):
-        gen_variants_impl(next[3:], results, preceding + 'syl')
-        gen_variants_impl(next[3:], results, preceding + 'sil')
-    gen_variants_impl(next[1:], results, preceding + next[0])
-
-
-def normalize(text):
-    text = unicodedata.normalize('NFC', text)
-    text = (text.lower()
-                .replace('ð', 'þ')
-                .replace('k', 'c')
-                .replace('&', 'and')
-                .replace('⁊', 'and')
-                .replace('ꝥ', 'thaet')
-                .replace('x', 'cs')
-                .replace('-', ""))
-    text = unidecode.unidecode(text)
+    elif first == 'a':
+        if next.startswith(('an', 'am')) and not preceding.endswith(('ē', 'e')):
+            gen_variants_impl(next[1:], results, preceding + 'o')
+    elif first == 'o':
+        if next.startswith(('on', 'om')) and not preceding.endswith(('ē', 'e')):
+            gen_variants_impl(next[1:], results, preceding + 'a')
+    elif first == 'c':
+        if next.startswith('cg'):
+            gen_variants_impl(next[2:], results, preceding + 'gg')
+    elif first == 'ċ':
+        if next.startswith('ċġ'):
+            gen_variants_impl(next[2:], results, preceding + 'ġġ')
+    elif first == 's':
+        if next.startswith('sel'):
+            gen_variants_impl(next[3:], results, preceding + 'syl')
+            gen_variants_impl(next[3:], results, preceding + 'sil')
+    gen_variants_impl(next[1:], results, preceding + first)
+
+
+# Returns the normalized spellings of the variants of a form
+# A normalized word is in 'variants' mode's index under a form if and only
+# if it's in this set.
+@functools.lru_cache(maxsize=8192)
+def variant_keys(form):
+    return frozenset(normalize(variant) for variant in gen_variants(form))
+
+
+# Reduces a normalized word to a coarser key. Any two spellings that
+# gen_variants() considers equivalent fold to the same key, so looking up
+# fold(normalize(word)) finds every form that word could be a variant of
+# (plus some that it isn't, which variant_keys() can weed out).
+# Each rule merges a class of spellings that gen_variants() swaps:
+FOLD_RULES = [
+    # i/y
+    (re.compile(r"y"), "i"),
+    # an/on, am/om
+    (re.compile(r"[ao](?=[nm])"), "a"),
+    # ie/i/y, io/eo, Anglian smoothing (eoh → eh), sel/syl/sil
+    (re.compile(r"[eio]*[ei][eio]*"), "e"),
+    # cg/gg (and double letters in general)
+    (re.compile(r"(.)\1+"), r"\1"),
+    (re.compile(r"c+g"), "g"),
+    (re.compile(r"(.)\1+"), r"\1"),
+    # burg/burh (and forms that lose the g entirely), trēow/trēo
+    (re.compile(r"(?:[cgh]|(?<=e)w)+$"), ""),
+]
+
+def fold(text):
+    for regex, replacement in FOLD_RULES:
+        text = regex.sub(replacement, text)
+    return text
+
+
+# Characters that normalize() respells, before transliteration to ASCII
+NORMALIZE_REPLACEMENTS = {
+    'ð': 'þ',
+    'k': 'c',
+    '&': 'and',
+    '⁊': 'and',
+    'ꝥ': 'thaet',
+    'x': 'cs',
+    '-': "",
+}
+
+# Translation table for normalize(), filled in lazily one character at a time
+# (unidecode works character by character, so this gives the same result as
+# calling it on the whole word). unidecode leaves ASCII alone, so it isn't
+# even imported until a word has some other character.
+class NormalizeTable(dict):
+    def __missing__(self, code):
+        ch = chr(code)
+        result = NORMALIZE_REPLACEMENTS.get(ch, ch)
+        if not result.isascii():
+            import unidecode
+            result = unidecode.unidecode(result)
+        self[code] = result
+        return result
+
+NORMALIZE_TABLE = NormalizeTable()
+
+# Use normalize() (which caches its results) except where nearly every word
+# is only normalized once, such as in index_words(), where the cache would
+# only fill up memory
+def normalize_uncached(text):
+    text = normalize_prefix(text)
     if len(text) >= 2 and text[-2] == text[-1]:
         # Word ends with double letter; reduce
         text = text[:-1]
@@ -677,6 +1074,56 @@ def normalize(text):
         text = text[:-3] + 'ng'
     return text
 
+normalize = functools.lru_cache(maxsize=65536)(normalize_uncached)
+
+# normalize() without the rules for the ends of words, for text that may be
+# only the beginning of a word: the "nn" of "cynn" is only reduced to "n"
+# at the end of the word, so "cynn" is the beginning of "cynnes" but not
+# of "cynd"
+def normalize_prefix(text):
+    text = unicodedata.normalize('NFC', text)
+    return text.lower().translate(NORMALIZE_TABLE)
+
+
+# The order of the letters in the dictionary (see collation_key())
+COLLATION_ALPHABET = "aæbcdefghijklmnopqrstþuvwxyz"
+
+# Characters that collation_key() respells, after removing diacritics
+COLLATION_REPLACEMENTS = {
+    'ð': 'þ',
+    '-': "",
+}
+
+# Translation table for collation_key(), filled in lazily one character at
+# a time. Letters of COLLATION_ALPHABET become consecutive characters from
+# 'a' on, so that keys sort in alphabetical order with a plain comparison.
+# Anything else before 'a' (spaces, digits, etc.) is left alone, so sorts
+# before every letter, and anything else after it is moved past the last
+# letter.
+class CollationTable(dict):
+    def __missing__(self, code):
+        decomposed = unicodedata.normalize('NFD', chr(code))
+        letters = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+        letters = COLLATION_REPLACEMENTS.get(letters, letters)
+        result = ""
+        for ch in letters:
+            if ch in COLLATION_ALPHABET:
+                result += chr(ord('a') + COLLATION_ALPHABET.index(ch))
+            elif ch < 'a':
+                result += ch
+            else:
+                result += chr(ord(ch) + 0x100)
+        self[code] = result
+        return result
+
+COLLATION_TABLE = CollationTable()
+
+# Returns a key that sorts words in the dictionary's alphabetical order: æ
+# comes after a and þ (or ð) after t, and case, diacritics and hyphens are
+# ignored
+def collation_key(word):
+    return word.lower().translate(COLLATION_TABLE)
+
 
 def expand_word_type(word_type):
     if word_type == 'adv':
@@ -735,3 +1182,9 @@ def expand_word_type(word_type):
     else:
         return "unknown"
 
+
+# Returns the part of speech of a word type, e.g. "noun" for 'nm' or "verb"
+# for 'vs3' (the last word of expand_word_type())
+def part_of_speech(word_type):
+    return expand_word_type(word_type).rsplit(" ", 1)[-1]
+
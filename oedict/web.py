@@ -0,0 +1,419 @@
+# The parts of the web API that don't depend on a web framework: settings,
+# rendering responses, caching headers and instrumentation. Both the WSGI
+# app (wsgi.py) and the ASGI app (asgi.py) are built on this, so they give
+# the same responses.
+
+import bisect
+import contextlib
+import datetime
+import hashlib
+import html
+import json
+import logging
+import math
+import os
+import threading
+import urllib.parse
+
+from . import lexdb
+
+
+LEX_FILENAME = 'lexicon.txt'
+DB_FILENAME = 'lexicon.out.sqlite3'
+
+# How often (in seconds) to check whether the database needs regenerating,
+# which is done in the background (0 turns it off), and how long the
+# lexicon has to be left alone before it's regenerated from
+CHECK_INTERVAL = float(os.environ.get('OEDICT_CHECK_INTERVAL', 60))
+SETTLE_TIME = float(os.environ.get('OEDICT_SETTLE_TIME', lexdb.SETTLE_TIME))
+
+# Whether to only regenerate changed entries when the lexicon is updated
+INCREMENTAL = os.environ.get('OEDICT_INCREMENTAL', '') not in ('', '0')
+
+# Whether to copy the whole database into memory (see lexdb.MemoryImage)
+IN_MEMORY = os.environ.get('OEDICT_IN_MEMORY', '') not in ('', '0')
+
+# Whether to look words up in a compiled lexicon (see lexbin) rather than
+# the database
+COMPILED = os.environ.get('OEDICT_COMPILED', '') not in ('', '0')
+
+# SQLite mmap_size and cache_size pragmas for each connection (unset means
+# SQLite's defaults)
+MMAP_SIZE = os.environ.get('OEDICT_MMAP_SIZE')
+CACHE_SIZE = os.environ.get('OEDICT_CACHE_SIZE')
+
+# How long (in seconds) browsers, and shared caches such as a CDN, may reuse
+# a response before checking whether it's still current (see etag())
+CACHE_MAX_AGE = int(os.environ.get('OEDICT_CACHE_MAX_AGE', 300))
+SHARED_CACHE_MAX_AGE = int(os.environ.get('OEDICT_SHARED_CACHE_MAX_AGE', CACHE_MAX_AGE))
+
+# Most completions, suggestions (or entries when browsing) a client can ask
+# for at once
+MAX_COMPLETION_LIMIT = 50
+MAX_SUGGESTION_LIMIT = 50
+MAX_BROWSE_LIMIT = 100
+
+# What the search routes search for when they aren't given anything
+DEFAULT_SEARCH_TERMS = "nawiht"
+DEFAULT_SEARCH_STRING = "nothing"
+
+# Whether to time requests and count what they do (see Metrics). The results
+# are sent in a Server-Timing header, requests slower than
+# SLOW_REQUEST_MS milliseconds are logged, and totals are served at /metrics.
+INSTRUMENT = os.environ.get('OEDICT_INSTRUMENT', '') not in ('', '0')
+SLOW_REQUEST_MS = float(os.environ.get('OEDICT_SLOW_REQUEST_MS', 500))
+
+# Upper bounds (in seconds) of the buckets of the request latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+slow_request_log = logging.getLogger('oedict.slow_requests')
+
+
+def make_pool():
+    return lexdb.LexDBPool(
+        LEX_FILENAME,
+        DB_FILENAME,
+        CHECK_INTERVAL,
+        in_memory=IN_MEMORY,
+        compiled=COMPILED,
+        settle_time=SETTLE_TIME,
+        mmap_size=MMAP_SIZE,
+        cache_size=CACHE_SIZE,
+        incremental=INCREMENTAL
+    )
+
+
+# Like pool.connection(), except that if stats isn't None the connection
+# records what it does in it
+@contextlib.contextmanager
+def connection(pool, stats=None):
+    if stats is None:
+        with pool.connection() as db:
+            yield db
+        return
+    with stats.phase('connect'):
+        db = pool.get()
+    db.stats = stats
+    try:
+        yield db
+    finally:
+        db.stats = None
+
+
+# Adds the time taken by the with block to the named phase of stats, if it
+# isn't None
+def phase(stats, name):
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.phase(name)
+
+
+# Responses that only depend on the request and the database only change
+# when the database is regenerated, so their ETag is made from the
+# database's build id, the request path and the (key, value) pairs of the
+# query string
+def etag(build_id, path, args):
+    args_key = [f"{key}={value}" for key, value in sorted(args)]
+    return hashlib.sha1("\0".join([build_id, path] + args_key).encode()).hexdigest()
+
+
+# Serializes the way flask.jsonify() does
+def to_json(obj):
+    return json.dumps(obj, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n"
+
+
+def search_oe(db, search_terms):
+    parts = []
+    for term in search_terms.split():
+        entries = db.lookup(term)
+        if len(entries) == 0:
+            parts.append(f"<h2>Not found: {html.escape(term)}</h2>\n")
+            parts.append(format_suggestions(db.suggest(term)))
+        else:
+            parts.append(format_entries(entries, db.stats))
+    return "".join(parts)
+
+
+# Yields the HTML of the entries a reverse search finds an entry at a time,
+# as they're read from the database (see LexDB.iter_reverse_lookup()), so
+# that the response can be streamed however many there are. If there are
+# more entries after the limit, it ends with a link to the next page: path
+# is the request's path, and the link keeps it and the limit, and adds a
+# cursor in place of the offset. A limit of 0 or less means no limit.
+def search_reverse(db, path, search_string, limit=None, offset=0, cursor=None):
+    if limit is not None and limit <= 0:
+        limit = None
+    results = db.iter_reverse_lookup(search_string, None if limit is None else limit + 1, offset, cursor)
+    found = 0
+    last_cursor = None
+    for entry, entry_cursor in results:
+        if found == limit:
+            break
+        found += 1
+        last_cursor = entry_cursor
+        with phase(db.stats, 'render'):
+            text = format_entry(entry)
+        yield text
+    else:
+        last_cursor = None
+    if found == 0:
+        yield f"<h2>Not found: {html.escape(search_string)}</h2>\n"
+    elif last_cursor is not None:
+        query = urllib.parse.urlencode({'cursor': last_cursor, 'limit': limit})
+        url = html.escape(f"{urllib.parse.quote(path)}?{query}")
+        yield f"<p><a rel=\"next\" href=\"{url}\">More</a></p>\n"
+
+
+# How many entries a reverse search finds in all, for the X-Total-Count
+# header of a streamed response (which is only a hint of how many the pages
+# will have between them, if the database is regenerated in between)
+def count_reverse(db, search_string):
+    return str(db.count_reverse_lookup(search_string))
+
+
+# Whether a request's cursor argument is one LexDB.iter_reverse_lookup() can
+# use (or there isn't one)
+def valid_reverse_cursor(cursor):
+    if cursor is None:
+        return True
+    try:
+        lexdb.parse_reverse_cursor(cursor)
+    except ValueError:
+        return False
+    return True
+
+
+# A JSON list of the lemmas of the entries most like word, for suggesting
+# corrections
+def suggest(db, word, limit=lexdb.SUGGESTION_LIMIT):
+    limit = max(0, min(limit, MAX_SUGGESTION_LIMIT))
+    entries = db.suggest(word, limit)
+    return to_json(list(dict.fromkeys(entry.lemma for entry in entries)))
+
+
+# A JSON list of the forms beginning with prefix, for completing words as
+# they're typed, e.g.:
+#   [{"form": "cyning", "lemma": "cyning", "word_type": "nm"}, ...]
+def complete(db, prefix, limit=lexdb.COMPLETION_LIMIT):
+    limit = max(0, min(limit, MAX_COMPLETION_LIMIT))
+    return to_json([
+        {'form': form, 'lemma': lemma, 'word_type': word_type}
+        for form, lemma, word_type in db.complete(prefix, limit)
+    ])
+
+
+# A JSON list of the inflection tables of the entries with a form spelled
+# like word (see LexDB.paradigms()), e.g.:
+#   [{"lemma": "cyning", "word_type": "nm", "label": "masculine strong noun",
+#     "forms": [{"name": "nom.sg", "forms": ["cyning"], "matched": false}, ...]}]
+def paradigms(db, word):
+    return to_json([
+        {
+            'lemma': lemma,
+            'word_type': word_type,
+            'label': label,
+            'forms': [
+                {'name': name, 'forms': forms, 'matched': matched}
+                for name, forms, matched in table
+            ],
+        }
+        for lemma, word_type, label, table in db.paradigms(word)
+    ])
+
+
+# A page of entries in alphabetical order (see LexDB.browse()), and the
+# value of a Link header pointing to the next page (or None if it's the
+# last one). path is the request's path; the link keeps it and the limit,
+# and adds the cursor.
+def browse(db, path, start="", cursor=None, limit=lexdb.BROWSE_LIMIT):
+    limit = max(0, min(limit, MAX_BROWSE_LIMIT))
+    entries, next_cursor = db.browse(start, cursor, limit)
+    link = None
+    if next_cursor is not None:
+        query = urllib.parse.urlencode({'cursor': next_cursor, 'limit': limit})
+        link = f'<{urllib.parse.quote(path)}?{query}>; rel="next"'
+    return format_entries(entries, db.stats), link
+
+
+# Whether a request's cursor argument is one LexDB.browse() can use (or
+# there isn't one)
+def valid_cursor(cursor):
+    if cursor is None:
+        return True
+    try:
+        lexdb.parse_browse_cursor(cursor)
+    except ValueError:
+        return False
+    return True
+
+
+# Looks up every word of text, yielding one JSON object per token, one per
+# line, e.g.:
+#   {"token": "Hwæt", "entries": [{"lemma": "hwæt", "word_types": ["pron"]}, ...]}
+def lemmatize(db, text):
+    for token, entries in db.lemmatize(text.splitlines()):
+        yield json.dumps({
+            'token': token,
+            'entries': [
+                {'lemma': entry.lemma, 'word_types': list(entry.word_types)}
+                for entry in entries
+            ],
+        }, ensure_ascii=False) + "\n"
+
+
+# A random entry (see LexDB.random_lookup()). types are the values of the
+# request's type arguments, each a part of speech with an optional weight,
+# e.g. ["noun:2", "verb"] (see parse_weights()).
+def random_entry(db, seed=None, types=()):
+    entry = db.random_lookup(seed, parse_weights(types))
+    if entry is None:
+        return "<h2>Not found</h2>\n"
+    return format_entries([entry], db.stats)
+
+
+# The word of the day for date, which is the same all day (for the same
+# lexicon)
+def daily_entry(db, date, types=()):
+    return random_entry(db, f"daily:{date.isoformat()}", types)
+
+
+# Parses "part of speech[:weight]" strings into a dict of weights for
+# LexDB.random_lookup(), or None if there aren't any. A weight that isn't a
+# number counts as 1, and one that's negative or isn't finite (such as
+# "inf" or "nan") is left out along with its part of speech.
+def parse_weights(types):
+    weights = {}
+    for value in types:
+        name, _, weight = value.partition(":")
+        try:
+            weight = float(weight) if weight else 1
+        except ValueError:
+            weight = 1
+        if math.isfinite(weight) and weight >= 0:
+            weights[name] = weight
+    return weights or None
+
+
+# The date of the word of the day, given the request's date argument (in
+# YYYY-MM-DD form), or today's date (UTC) if there isn't a valid one. Also
+# returns how many seconds a response may be reused for, which is until the
+# end of the day if the date is today's.
+def daily_date(arg, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    try:
+        return datetime.date.fromisoformat(arg), CACHE_MAX_AGE
+    except (TypeError, ValueError):
+        tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+        return now.date(), min(CACHE_MAX_AGE, int((tomorrow - now).total_seconds()))
+
+
+# The definitions and word types were rendered when the database was
+# generated, so this just puts the pieces together
+def format_entries(entries, stats=None):
+    with phase(stats, 'render'):
+        return "".join([format_entry(entry) for entry in entries])
+
+
+def format_entry(entry):
+    return "".join([
+        f"<h2 lang=\"ang\">{html.escape(entry.lemma)}</h2>\n",
+        f"<p><i>{html.escape('; '.join(entry.word_type_labels))}</i></p>\n",
+        entry.definition_html,
+    ])
+
+
+def format_suggestions(entries):
+    if len(entries) == 0:
+        return ""
+    lemmas = dict.fromkeys(entry.lemma for entry in entries)
+    links = ", ".join(f"<i lang=\"ang\">{html.escape(lemma)}</i>" for lemma in lemmas)
+    return f"<p>Did you mean: {links}?</p>\n"
+
+
+# The Server-Timing header for a request that took seconds in total
+def server_timing(stats, seconds):
+    timings = [f"{name};dur={duration * 1000:.3f}" for name, duration in stats.timings.items()]
+    timings.append(f'sql;desc="{stats.statements} statements, {stats.rows} rows"')
+    timings.append(f"total;dur={seconds * 1000:.3f}")
+    return ", ".join(timings)
+
+
+# Logs a request to slow_request_log as a line of JSON if it took at least
+# SLOW_REQUEST_MS
+def log_if_slow(method, path, query, route, status, seconds, stats):
+    if seconds * 1000 < SLOW_REQUEST_MS:
+        return
+    slow_request_log.warning(json.dumps({
+        'method': method,
+        'path': path,
+        'query': query,
+        'route': route,
+        'status': status,
+        'duration_ms': round(seconds * 1000, 3),
+        'phases_ms': {name: round(duration * 1000, 3) for name, duration in stats.timings.items()},
+        'statements': stats.statements,
+        'rows': stats.rows,
+        'redirect_depth': stats.redirect_depth,
+        'results': stats.results,
+    }, ensure_ascii=False))
+
+
+# Request counts and latency histograms for each route, plus totals of what
+# the requests did (see lexdb.Stats), in the Prometheus text format
+class Metrics(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route, seconds, stats):
+        with self.lock:
+            metrics = self.routes.get(route)
+            if metrics is None:
+                metrics = self.routes[route] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0,
+                    'statements': 0,
+                    'rows': 0,
+                    'redirects': 0,
+                    'results': 0,
+                }
+            metrics['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+            metrics['sum'] += seconds
+            metrics['count'] += 1
+            metrics['statements'] += stats.statements
+            metrics['rows'] += stats.rows
+            metrics['redirects'] += stats.redirect_depth
+            metrics['results'] += stats.results
+
+    def render(self):
+        with self.lock:
+            routes = {route: dict(metrics, buckets=list(metrics['buckets']))
+                      for route, metrics in sorted(self.routes.items())}
+        lines = [
+            "# HELP oedict_request_duration_seconds Time taken to handle requests",
+            "# TYPE oedict_request_duration_seconds histogram",
+        ]
+        for route, metrics in routes.items():
+            label = f'route="{escape_label(route)}"'
+            count = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), metrics['buckets']):
+                count += bucket_count
+                lines.append(f'oedict_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"oedict_request_duration_seconds_sum{{{label}}} {metrics['sum']}")
+            lines.append(f"oedict_request_duration_seconds_count{{{label}}} {metrics['count']}")
+        for key, name, help in [
+            ('statements', 'oedict_sql_statements_total', "SQL statements run"),
+            ('rows', 'oedict_sql_rows_total', "Rows read by SQL statements"),
+            ('redirects', 'oedict_redirects_total', "Levels of redirects followed by lookups"),
+            ('results', 'oedict_results_total', "Entries and completions returned"),
+        ]:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+            for route, metrics in routes.items():
+                lines.append(f'{name}{{route="{escape_label(route)}"}} {metrics[key]}')
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
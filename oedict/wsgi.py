@@ -1,58 +1,207 @@
-import html
+import atexit
+import functools
+import time
 
 import flask
-import markdown
 
 from . import lexdb
-from . import lexicon
+from . import web
 
 
-LEX_FILENAME = 'lexicon.txt'
-DB_FILENAME = 'lexicon.out.sqlite3'
+application = flask.Flask(__name__)
 
+pool = web.make_pool()
+atexit.register(pool.close)
+
+metrics = web.Metrics()
+
+
+# Decorator for views whose responses only depend on the request and the
+# database, which means they only change when the database is regenerated.
+# Responses get an ETag made from the database's build id and the request,
+# and a request whose If-None-Match (or If-Modified-Since) shows the client
+# already has the current response gets a 304 without calling the view, so
+# the database isn't touched.
+def cached(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        build_id, build_time = pool.build_info()
+        request = flask.request
+        etag = web.etag(build_id, request.path, request.args.items(multi=True))
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = (request.if_modified_since is not None
+                            and request.if_modified_since.timestamp() >= build_time)
+        if not_modified:
+            response = flask.Response(status=304)
+        else:
+            response = flask.make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.last_modified = build_time
+        response.cache_control.public = True
+        response.cache_control.max_age = web.CACHE_MAX_AGE
+        response.cache_control.s_maxage = web.SHARED_CACHE_MAX_AGE
+        return response
+    return wrapper
+
+
+# Like pool.connection(), except that the connection records what it does in
+# the current request's stats while instrumentation is on
+def connection():
+    return web.connection(pool, request_stats())
+
+
+# The current request's stats, or None if instrumentation is off. A streamed
+# response is generated after the request has finished, so its generator is
+# given these rather than looking them up, and finish_request() records
+# them once the stream has been sent.
+def request_stats():
+    return flask.g.get('stats') if web.INSTRUMENT else None
+
+
+def start_request():
+    flask.g.stats = lexdb.Stats()
+    flask.g.start_time = time.perf_counter()
+
+
+def finish_request(response):
+    stats = flask.g.pop('stats', None)
+    if stats is None:
+        return response
+    start_time = flask.g.start_time
+    request = flask.request
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    method = request.method
+    path = request.path
+    query = request.query_string.decode('latin-1')
+    status = response.status_code
+
+    def record():
+        seconds = time.perf_counter() - start_time
+        metrics.observe(route, seconds, stats)
+        web.log_if_slow(method, path, query, route, status, seconds, stats)
+
+    # A streamed body hasn't been generated yet, so its Server-Timing only
+    # covers what was done first, and it's recorded once it's been sent
+    response.headers['Server-Timing'] = web.server_timing(stats, time.perf_counter() - start_time)
+    if response.is_streamed:
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+# The instrumentation is only hooked in when it's on, so it costs nothing
+# otherwise
+if web.INSTRUMENT:
+    application.before_request(start_request)
+    application.after_request(finish_request)
+
+    @application.route('/metrics')
+    def metrics_view():
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-application = flask.Flask(__name__)
 
 @application.route('/api/search/oe/')
 @application.route('/api/search/oe/<search_terms>')
-def search_oe(search_terms="nawiht"):
-    with lexdb.LexDB(LEX_FILENAME, DB_FILENAME) as db:
-        search_terms = search_terms.split()
-        text = ""
-        for term in search_terms:
-            entries = db.lookup(term)
-            if len(entries) == 0:
-                text += f"<h2>Not found: {html.escape(term)}</h2>\n"
-            else:
-                text += format_entries(entries)
-    return text
+@cached
+def search_oe(search_terms=web.DEFAULT_SEARCH_TERMS):
+    with connection() as db:
+        return web.search_oe(db, search_terms)
 
 
 @application.route('/api/search/reverse/')
 @application.route('/api/search/reverse/<search_string>')
-def search_reverse(search_string="nothing"):
-    with lexdb.LexDB(LEX_FILENAME, DB_FILENAME) as db:
-        entries = db.reverse_lookup(search_string)
-        if len(entries) == 0:
-            text = f"<h2>Not found: {html.escape(search_string)}</h2>\n"
-        else:
-            text = format_entries(entries)
-    return text
+@cached
+def search_reverse(search_string=web.DEFAULT_SEARCH_STRING):
+    limit = flask.request.args.get('limit', type=int)
+    offset = flask.request.args.get('offset', 0, type=int)
+    cursor = flask.request.args.get('cursor')
+    if not web.valid_reverse_cursor(cursor):
+        flask.abort(400)
+    path = flask.request.path
+    stats = request_stats()
+    with connection() as db:
+        total = web.count_reverse(db, search_string)
+
+    def generate():
+        with web.connection(pool, stats) as db:
+            yield from web.search_reverse(db, path, search_string, limit, offset, cursor)
+
+    # The entries are streamed as they're read, like lemmatize()'s results
+    response = flask.Response(generate())
+    response.headers['X-Total-Count'] = total
+    return response
+
+
+@application.route('/api/suggest/<word>')
+@cached
+def suggest(word):
+    limit = flask.request.args.get('limit', lexdb.SUGGESTION_LIMIT, type=int)
+    with connection() as db:
+        return flask.Response(web.suggest(db, word, limit), mimetype='application/json')
+
+
+@application.route('/api/complete/<prefix>')
+@cached
+def complete(prefix):
+    limit = flask.request.args.get('limit', lexdb.COMPLETION_LIMIT, type=int)
+    with connection() as db:
+        return flask.Response(web.complete(db, prefix, limit), mimetype='application/json')
+
+
+@application.route('/api/paradigm/<word>')
+@cached
+def paradigms(word):
+    with connection() as db:
+        return flask.Response(web.paradigms(db, word), mimetype='application/json')
+
+
+@application.route('/api/browse/')
+@application.route('/api/browse/<start>')
+@cached
+def browse(start=""):
+    cursor = flask.request.args.get('cursor')
+    if not web.valid_cursor(cursor):
+        flask.abort(400)
+    limit = flask.request.args.get('limit', lexdb.BROWSE_LIMIT, type=int)
+    with connection() as db:
+        text, link = web.browse(db, flask.request.path, start, cursor, limit)
+    response = flask.make_response(text)
+    if link is not None:
+        response.headers['Link'] = link
+    return response
+
+
+@application.route('/api/lemmatize', methods=['POST'])
+def lemmatize():
+    text = flask.request.get_data(as_text=True)
+    stats = request_stats()
+
+    def generate():
+        with web.connection(pool, stats) as db:
+            yield from web.lemmatize(db, text)
+
+    return flask.Response(generate(), mimetype='application/x-ndjson')
 
 
 @application.route('/api/search/random/')
 def random():
-    with lexdb.LexDB(LEX_FILENAME, DB_FILENAME) as db:
-        text = format_entries([db.random_lookup()])
-    return text
-
+    args = flask.request.args
+    with connection() as db:
+        text = web.random_entry(db, args.get('seed'), args.getlist('type'))
+    response = flask.make_response(text)
+    response.cache_control.no_store = True
+    return response
 
-def format_entries(entries):
-    text = ""
-    for entry in entries:
-        types = "; ".join(lexicon.expand_word_type(word_type) for word_type in entry.word_types)
-        text += f"<h2 lang=\"ang\">{html.escape(entry.lemma)}</h2>\n"
-        text += f"<p><i>{html.escape(types)}</i></p>\n"
-        text += markdown.markdown(entry.text)
-    return text
 
+@application.route('/api/search/daily/')
+def daily():
+    date, max_age = web.daily_date(flask.request.args.get('date'))
+    with connection() as db:
+        text = web.daily_entry(db, date, flask.request.args.getlist('type'))
+    response = flask.make_response(text)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
@@ -0,0 +1,91 @@
+# A client that calls an ASGI application in the same process, for testing
+# oedict.asgi without a server (any ASGI transport would do as well, e.g.
+# httpx.ASGITransport):
+#   client = Client(oedict.asgi.application)
+#   response = client.get('/api/search/oe/cyning')
+#   response.status, response.headers['content-type'], response.text
+
+import asyncio
+import urllib.parse
+
+
+class Response(object):
+    def __init__(self):
+        self.status = None
+        # Keyed by lower-case name
+        self.headers = {}
+        self.body = b""
+        # The body in the chunks it was sent in
+        self.chunks = []
+
+    @property
+    def text(self):
+        return self.body.decode()
+
+
+class Client(object):
+    def __init__(self, app):
+        self.app = app
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request('GET', url, headers=headers, **kwargs)
+
+    def post(self, url, data=b"", headers=None, **kwargs):
+        return self.request('POST', url, data, headers, **kwargs)
+
+    def request(self, method, url, data=b"", headers=None, **kwargs):
+        return asyncio.run(self.request_async(method, url, data, headers, **kwargs))
+
+    # If disconnect_after is given, the client goes away that many seconds
+    # after sending the request, whether the response has finished or not.
+    # on_chunk(response) is awaited after each chunk of the body, e.g. to
+    # read slowly.
+    async def request_async(self, method, url, data=b"", headers=None, disconnect_after=None, on_chunk=None):
+        path, _, query = url.partition("?")
+        if isinstance(data, str):
+            data = data.encode()
+        headers = [('host', 'localhost')] + [(name.lower(), value) for name, value in (headers or {}).items()]
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': urllib.parse.unquote(path),
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': "",
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        response = Response()
+        finished = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            try:
+                await asyncio.wait_for(finished.wait(), disconnect_after)
+            except asyncio.TimeoutError:
+                pass
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response.status = message['status']
+                for name, value in message['headers']:
+                    response.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+            elif message['type'] == 'http.response.body':
+                body = message.get('body', b"")
+                response.body += body
+                if body:
+                    response.chunks.append(body)
+                    if on_chunk is not None:
+                        await on_chunk(response)
+                if not message.get('more_body'):
+                    finished.set()
+
+        await self.app(scope, receive, send)
+        return response
@@ -0,0 +1,47 @@
+import os
+import shutil
+
+import pytest
+
+from oedict import lexdb
+
+LEXICON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lexicon.txt')
+
+
+# A copy of lexicon.txt and the database generated from it, shared by every
+# test in the session (generating it takes a few seconds)
+@pytest.fixture(scope='session')
+def lex_files(tmp_path_factory):
+    dirname = tmp_path_factory.mktemp('lexicon')
+    lex_filename = str(dirname / 'lexicon.txt')
+    db_filename = str(dirname / 'lexicon.out.sqlite3')
+    shutil.copy(LEXICON, lex_filename)
+    lexdb.LexDB.gen_db(lex_filename, db_filename)
+    return lex_filename, db_filename
+
+
+@pytest.fixture
+def db(lex_files):
+    with lexdb.LexDB(*lex_files, check_outdated=False) as db:
+        yield db
+
+
+# oedict.asgi's application, serving lex_files. The app makes its pool when
+# it's imported, from the files in the current directory.
+@pytest.fixture(scope='session')
+def asgi_app(lex_files):
+    from oedict import web
+    web.CHECK_INTERVAL = 0
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(lex_files[0]))
+    try:
+        from oedict import asgi
+    finally:
+        os.chdir(cwd)
+    return asgi.application
+
+
+@pytest.fixture
+def asgi_client(asgi_app):
+    from asgi_client import Client
+    return Client(asgi_app)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+from asgi_client import Client
+
+
+def test_lookup(asgi_client):
+    response = asgi_client.get('/api/search/oe/cyning')
+    assert response.status == 200
+    assert response.headers['content-type'].startswith('text/html')
+    assert "cyning" in response.text
+
+
+def test_head(asgi_client):
+    response = asgi_client.request('HEAD', '/api/search/oe/cyning')
+    assert response.status == 200
+    assert response.body == b""
+
+
+def test_not_modified(asgi_client):
+    etag = asgi_client.get('/api/search/oe/cyning').headers['etag']
+    response = asgi_client.get('/api/search/oe/cyning', {'If-None-Match': etag})
+    assert response.status == 304
+    assert response.body == b""
+
+
+def test_errors(asgi_client):
+    response = asgi_client.get('/api/nothing')
+    assert response.status == 404
+    assert response.headers['content-type'].startswith('text/plain')
+    assert asgi_client.get('/api/lemmatize').status == 405
+    assert asgi_client.get('/api/search/reverse/king?cursor=nan:1').status == 400
+
+
+def test_reverse_pages(asgi_client):
+    response = asgi_client.get('/api/search/reverse/king?limit=1')
+    assert response.status == 200
+    assert int(response.headers['x-total-count']) > 1
+    assert response.text.count("<h2 ") == 1
+    assert 'rel="next"' in response.text
+    everything = asgi_client.get('/api/search/reverse/king')
+    assert everything.text.count("<h2 ") == int(response.headers['x-total-count'])
+
+
+def test_lemmatize(asgi_client):
+    response = asgi_client.post('/api/lemmatize', "se cyning")
+    assert response.status == 200
+    tokens = [json.loads(line) for line in response.text.splitlines()]
+    assert [token['token'] for token in tokens if 'token' in token][-1] == "cyning"
+
+
+def test_disconnect(asgi_client):
+    # Nothing is waiting for the response, and the app has to notice
+    asgi_client.get('/api/search/reverse/the', disconnect_after=0)
+    assert asgi_client.get('/api/search/oe/cyning').status == 200
+
+
+def test_slow_readers(asgi_app):
+    from oedict import asgi
+
+    # More clients than there are threads read the first chunk of a long
+    # reverse search and then stop, and a lookup still gets answered
+    async def main():
+        client = Client(asgi_app)
+        reading = asyncio.Semaphore(0)
+        release = asyncio.Event()
+
+        async def read_slowly(response):
+            if len(response.chunks) == 1:
+                reading.release()
+            await release.wait()
+
+        readers = [
+            asyncio.ensure_future(client.request_async('GET', '/api/search/reverse/to', on_chunk=read_slowly))
+            for _ in range(asgi.WORKERS * 2)
+        ]
+        for _ in readers:
+            await asyncio.wait_for(reading.acquire(), 10)
+        lookup = await asyncio.wait_for(client.request_async('GET', '/api/search/oe/cyning'), 10)
+        release.set()
+        return lookup, await asyncio.gather(*readers)
+
+    lookup, readers = asyncio.run(main())
+    assert lookup.status == 200
+    for response in readers:
+        assert len(response.chunks) > 1
+        assert response.text.count("<h2 ") == int(response.headers['x-total-count'])
@@ -0,0 +1,16 @@
+import pytest
+
+from oedict import cli
+
+
+def test_jobs():
+    assert cli.parse_args(['-j', '0']).jobs == 0
+    assert cli.parse_args(['-j', '4']).jobs == 4
+    assert cli.parse_args([]).jobs == 1
+
+
+def test_negative_jobs(capsys):
+    with pytest.raises(SystemExit) as info:
+        cli.parse_args(['-j', '-1'])
+    assert info.value.code == 2
+    assert "negative" in capsys.readouterr().err
@@ -0,0 +1,20 @@
+import os
+
+from oedict import cli, lexicon
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+# forms.tsv is the --dump-forms output for forms_lexicon.txt (every entry of
+# lexicon.txt with specials, and the first few of each word type), as the
+# paradigm code made it before it was table-driven. If a change to
+# lexicon.gen_forms() is meant to change the forms, regenerate it with
+#   python -m oedict -l tests/data/forms_lexicon.txt --dump-forms > tests/data/forms.tsv
+def test_forms(capsys):
+    cli.dump_forms(lexicon.Lexicon(os.path.join(DATA_DIR, 'forms_lexicon.txt'), gen_index=False))
+    forms = capsys.readouterr().out.splitlines()
+    with open(os.path.join(DATA_DIR, 'forms.tsv'), encoding='utf-8') as infile:
+        expected = infile.read().splitlines()
+    changed = [(line, expected_line) for line, expected_line in zip(forms, expected) if line != expected_line]
+    assert changed[:10] == []
+    assert len(forms) == len(expected)
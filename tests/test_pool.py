@@ -0,0 +1,25 @@
+import threading
+
+from oedict import lexdb, lexicon
+
+
+def thread_names(entry, paradigms):
+    return [thread.name for thread in threading.enumerate()]
+
+
+# gen_db's worker processes mustn't start watchers of their own for a pool
+# in the process that started them
+def test_index_workers_have_no_watcher(lex_files):
+    with lexdb.LexDBPool(*lex_files) as pool:
+        assert pool.watcher.is_alive()
+        entries = lexicon.Lexicon(lex_files[0], gen_index=False).entries[:8]
+        for words, names in lexicon.index_entries(entries, jobs=2, prepare=thread_names):
+            assert names == ["MainThread"]
+
+
+def test_closed_pools_are_forgotten(lex_files):
+    count = len(lexdb.forked_pools)
+    for _ in range(5):
+        with lexdb.LexDBPool(*lex_files, check_interval=0):
+            assert len(lexdb.forked_pools) == count + 1
+    assert len(lexdb.forked_pools) == count
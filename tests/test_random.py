@@ -0,0 +1,43 @@
+import pytest
+
+from oedict import lexicon, web
+
+
+@pytest.mark.parametrize('weight', ['inf', '-inf', 'nan', '-1', '1e400'])
+def test_parse_weights_leaves_out_bad_weights(weight):
+    assert web.parse_weights([f"noun:{weight}"]) is None
+    assert web.parse_weights([f"noun:{weight}", "verb:2"]) == {'verb': 2}
+
+
+def test_parse_weights():
+    assert web.parse_weights(["noun:2", "verb", "adverb:x", "adjective:0"]) == {
+        'noun': 2, 'verb': 1, 'adverb': 1, 'adjective': 0
+    }
+    assert web.parse_weights([]) is None
+
+
+@pytest.mark.parametrize('weights', [
+    {'noun': float('inf')},
+    {'noun': float('nan')},
+    {'noun': -1},
+    {'noun': 0},
+    {'noun': 1e308, 'verb': 1e308},
+    {'noun': float('inf'), 'verb': 1},
+])
+def test_random_lookup_with_bad_weights(db, weights):
+    for seed in range(20):
+        entry = db.random_lookup(seed, weights)
+        assert entry is not None
+        assert any(lexicon.part_of_speech(word_type) in weights for word_type in entry.word_types)
+
+
+def test_random_lookup_weights(db):
+    for seed in range(20):
+        entry = db.random_lookup(seed, {'noun': 0, 'verb': 1})
+        assert 'verb' in [lexicon.part_of_speech(word_type) for word_type in entry.word_types]
+    assert db.random_lookup(0, {'nothing': 1}) is None
+
+
+@pytest.mark.parametrize('query', ['noun:inf', 'noun:nan', 'noun:-1', 'noun:1e308&type=verb:1e308'])
+def test_random_entry_with_bad_weights(db, query):
+    assert "Not found" not in web.random_entry(db, 0, query.split('&type='))
@@ -0,0 +1,51 @@
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The benchmark's own list of lazy modules and startup budget (see
+# bench/benchmark.py), so that the two can't disagree
+spec = importlib.util.spec_from_file_location('benchmark', os.path.join(ROOT_DIR, 'bench', 'benchmark.py'))
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+RUNS = 9
+
+
+def run(lex_files, *args, **kwargs):
+    return subprocess.run(
+        [sys.executable] + list(args),
+        cwd=os.path.dirname(lex_files[0]),
+        env=dict(os.environ, PYTHONPATH=ROOT_DIR),
+        check=True,
+        **kwargs
+    )
+
+
+def test_lookup_imports(lex_files):
+    script = (
+        "import sys\n"
+        "from oedict import cli\n"
+        "cli.main(['cyning'])\n"
+        f"print(sorted(set({benchmark.LAZY_MODULES!r}) & set(sys.modules)), file=sys.stderr)\n"
+    )
+    output = run(lex_files, '-c', script, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    assert output.stderr.strip() == "[]"
+
+
+def median_time(lex_files, *args):
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        run(lex_files, *args, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def test_startup_budget(lex_files):
+    overhead = median_time(lex_files, '-m', 'oedict', 'cyning') - median_time(lex_files, '-c', 'pass')
+    assert overhead * 1000 <= benchmark.STARTUP_BUDGET_MS
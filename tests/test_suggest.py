@@ -0,0 +1,28 @@
+import json
+
+from oedict import lexdb, web
+
+
+def test_suggest(db):
+    assert "cyning" in [entry.lemma for entry in db.suggest("cynig", 5)]
+    assert db.suggest("", 3) == []
+
+
+# The candidates' entries are found with one query however many candidates
+# there are, so going through more of them doesn't take more queries
+def test_suggest_queries(db):
+    statements = []
+    try:
+        for limit in (1, 50):
+            db.stats = lexdb.Stats()
+            results = db.suggest("cyning", limit)
+            statements.append(db.stats.statements)
+    finally:
+        db.stats = None
+    assert len(results) > 2
+    assert statements[0] == statements[1]
+
+
+def test_web_suggest_limit(db):
+    assert len(json.loads(web.suggest(db, "cyning", 100000000))) <= web.MAX_SUGGESTION_LIMIT
+    assert json.loads(web.suggest(db, "cyning", -1)) == []